@@ -1 +1,25 @@
 from .client import STPClient
+from .pool import STPClientPool
+from .async_client import AsyncSTPClient
+from .cache import WaveformCache
+from .stats import ClientStats, CommandStats
+from .jobs import BulkTrigJob
+from .store import CatalogStore
+from .availability import AvailabilityIndex
+from .prefetch import TrigPrefetcher
+
+
+def __getattr__(name):
+    # LazyCatalog subclasses the ObsPy Catalog and the tables and sinks
+    # use NumPy, so they are only imported when they are used to keep
+    # ObsPy and NumPy from being loaded by import pystp.
+    if name == 'LazyCatalog':
+        from .lazy import LazyCatalog
+        return LazyCatalog
+    if name in ('EventTable', 'PickTable'):
+        from . import tables
+        return getattr(tables, name)
+    if name in ('HDF5Sink', 'ParquetSink'):
+        from . import sinks
+        return getattr(sinks, name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -0,0 +1,408 @@
+from __future__ import print_function
+
+import asyncio
+import io
+import os
+import struct
+
+from . import utils
+from .client import VALID_FORMATS
+
+
+class AsyncSTPClient:
+    """ An STP client that uses asyncio streams instead of blocking sockets.
+    The commands and results match those of STPClient.
+    """
+
+    def __init__(self, host='stp.gps.caltech.edu', port=9999, output_dir='.', verbose=False):
+        """ Set up a new AsyncSTPClient object.
+        """
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.fdout = None    # Output file handle
+        self.base_output_dir = output_dir
+        self.output_dir = output_dir
+        self.message = ''  # Most recent message from the server
+        self.motd = ''     # Message of the Day
+        self.error = None  # Most recent error message from the server
+        self.verbose = verbose
+        self.connected = False
+        self.data_format = None  # Waveform data format set on the server
+        self._lock = asyncio.Lock()
+
+
+    async def _send(self, cmd):
+        """ Send a command string to the server.
+        """
+
+        self.writer.write(cmd.encode('utf-8'))
+        await self.writer.drain()
+
+
+    async def _read_message(self):
+        """ Read and store text sent from the STP server delimited
+        by MESS and ENDmess.
+        """
+
+        lines = []
+        while True:
+            line = await self.reader.readline()
+
+            if not line or line == b'OVER\n' or line == b'ENDmess\n':
+                break
+
+            lines.append(line)
+        return b''.join(lines).decode('ascii')
+
+
+    def _process_error(self, fields):
+        """ Display and record STP error messages.
+        """
+
+        err_msg = ' '.join(fields[1:])
+        self.error = err_msg
+        print(err_msg)
+
+
+    async def _read_reply(self):
+        """ Read a reply consisting of a message or an error
+        followed by OVER.
+        """
+
+        message = ''
+        line = await self.reader.readline()
+        if line == b'MESS\n':
+            message = await self._read_message()
+        else:
+            words = line.decode('ascii').split()
+            if words and words[0] == 'ERR':
+                self._process_error(words)
+        await self.reader.readline()   # Read the b'OVER\n'
+        return message
+
+
+    def _close_output(self):
+        """ Close the current output file. In-memory buffers are left
+        open so that they can still be decoded.
+        """
+
+        if self.fdout and not isinstance(self.fdout, io.BytesIO):
+            self.fdout.close()
+        self.fdout = None
+
+
+    async def _receive_data(self, dir_lst=None, file_lst=None, buffers=None):
+        """ Process results sent by the STP server.
+
+        If buffers is a dict, the contents of each FILE are collected
+        in a BytesIO keyed by the file path instead of being written to disk.
+        Raises ConnectionError if the connection is closed before OVER.
+        """
+
+        if dir_lst is None:
+            dir_lst = []
+        if file_lst is None:
+            file_lst = []
+        while True:
+            line = await self.reader.readline()
+            if self.verbose:
+                print('_receive_data: Received line ', line)
+            if not line:
+                self.output_dir = self.base_output_dir
+                self.connected = False
+                raise ConnectionError('Connection to the STP server was closed before the end of the response')
+
+            line_words = line.decode('ascii').split()
+            if len(line_words) == 0:
+                continue
+
+            if line_words[0] == 'OVER':
+                self.output_dir = self.base_output_dir
+                break
+            elif line_words[0] == 'FILE':
+                self._close_output()
+                outfile = os.path.join(self.output_dir, line_words[1])
+                if buffers is not None:
+                    self.fdout = io.BytesIO()
+                    buffers[outfile] = self.fdout
+                    file_lst.append(outfile)
+                    continue
+                if self.verbose:
+                    print('Opening {} for writing'.format(outfile))
+                self.fdout = open(outfile, 'wb')
+                file_lst.append(outfile)
+            elif line_words[0] == 'DIR':
+                self.output_dir = os.path.join(self.output_dir, line_words[1])
+                if buffers is None and not os.path.isdir(self.output_dir):
+                    os.mkdir(self.output_dir)
+                    dir_lst.append(self.output_dir)
+            elif line_words[0] == 'MESS':
+                self.message += await self._read_message()
+            elif line_words[0] == 'DATA':
+                try:
+                    data = await self.reader.readexactly(int(line_words[1]))
+                except asyncio.IncompleteReadError:
+                    self.output_dir = self.base_output_dir
+                    self.connected = False
+                    raise ConnectionError('Connection to the STP server was closed before the end of the response')
+                if self.fdout:
+                    self.fdout.write(data)
+            elif line_words[0] == 'ENDdata':
+                continue
+            elif line_words[0] == 'ERR':
+                self._process_error(line_words)
+
+
+    async def connect(self, show_motd=True):
+        """ Connect to STP server.
+        """
+
+        if self.connected:
+            print('Already connected')
+            return
+
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        await self._send('STP stpisgreat 1.6.3 stpc\n')
+
+        line = await self.reader.readline()
+        if line != b'CONNECTED\n':
+            print(line)
+            raise Exception('Failed to connect')
+
+        # Send the integer 2 to the server to verify endianness.
+        self.writer.write(struct.Struct('I').pack(2))
+        await self.writer.drain()
+
+        self.motd = await self._read_reply()
+        if show_motd:
+            print(self.motd, end='')
+        self.connected = True
+        self._clear_message()
+
+
+    async def disconnect(self):
+        """ Disconnect from the STP server.
+        """
+
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        self.reader = None
+        self.writer = None
+        self.connected = False
+        self.data_format = None
+
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.disconnect()
+
+
+    def set_verbose(self, verbose):
+        self.verbose = verbose
+
+
+    def set_output_dir(self, output_dir):
+        """ Change the base output directory.
+        """
+        self.base_output_dir = output_dir
+        self.output_dir = output_dir
+
+
+    async def set_nevntmax(self, value=100):
+        """ Set the value of the nevntmax parameter, the maximum
+        number of events returned by the event command.
+        """
+        async with self._lock:
+            await self._send('set nevntmax {}\n'.format(value))
+            await self.reader.readline()
+
+
+    async def set_gaincorr(self, value='on'):
+        """ Set the value of the gain parameter to on or off.
+        """
+        async with self._lock:
+            self.error = None
+            await self._send('gain {}\n'.format(value))
+            self.message = await self._read_reply()
+            if self.verbose:
+                print(self.message)
+            self._clear_message()
+
+
+    async def _send_data_command(self, cmd, data_format):
+        """ Send a waveform request command and receive the files into
+        memory. Returns the list of file paths and a dict of their buffers.
+        """
+
+        data_format = data_format.lower()
+        if data_format not in VALID_FORMATS:
+            raise Exception('Invalid data format')
+
+        file_lst = []
+        dir_lst = []
+        buffers = {}
+        if data_format != self.data_format:
+            # The format only needs to be sent once per session.
+            self.error = None
+            await self._send('{}\n'.format(data_format))
+            await self._receive_data(dir_lst, file_lst, buffers)
+            if self.error is None:
+                self.data_format = data_format
+        self.error = None
+        await self._send(cmd)
+        await self._receive_data(dir_lst, file_lst, buffers)
+        self._close_output()
+        return file_lst, buffers
+
+
+    def _finish_waveforms(self, file_lst, buffers, as_stream, keep_files):
+        """ Write the received files to disk unless they are only decoded,
+        and decode them into a Stream if as_stream is True. This blocks,
+        so it is run in an executor to keep the event loop responsive.
+        """
+
+        if not as_stream or keep_files:
+            for f in file_lst:
+                os.makedirs(os.path.dirname(f) or '.', exist_ok=True)
+                with open(f, 'wb') as fdout:
+                    fdout.write(buffers[f].getbuffer())
+        if as_stream:
+            return utils.make_stream(file_lst, buffers, keep_files, self.verbose)
+        return None
+
+
+    def _end_command(self):
+        """ Perform cleanup after an STP command is ended.
+        """
+
+        self._close_output()
+        self._clear_message()
+
+
+    def _clear_message(self):
+        self.message = ''
+
+
+    async def get_trig(self, evids, net='%', sta='%', chan='%', loc='%', radius=None, data_format='sac', as_stream=True, keep_files=False):
+        """ Download triggered waveforms from STP using the TRIG command.
+        """
+
+        if not self.connected:
+            print('STP is not connected')
+            return None
+
+        if not isinstance(evids, list):
+            evids = [evids]
+        loop = asyncio.get_running_loop()
+        futures = []
+        async with self._lock:
+            for evid in evids:
+                cmd = utils.make_trig_command(evid, net, sta, chan, loc, radius)
+                file_lst, buffers = await self._send_data_command(cmd, data_format)
+                # Decode each event while the next one is received.
+                futures.append(loop.run_in_executor(None, self._finish_waveforms, file_lst, buffers, as_stream, keep_files))
+            self._end_command()
+        return dict(zip(evids, await asyncio.gather(*futures)))
+
+
+    async def get_window(self, start_time, end_time, net='%', sta='%', chan='%', loc='%', data_format='sac', as_stream=True, keep_files=False):
+        """ Download continuous waveforms from STP using the WIND command.
+        """
+
+        if not self.connected:
+            print('STP is not connected')
+            return None
+        if not start_time or not end_time:
+            print('Time range is required')
+            return None
+        if net == '%' and sta == '%' and chan == '%':
+            print('At least one of net/sta/chan is required.')
+            return None
+
+        cmd = utils.make_wind_command(start_time, end_time, net, sta, chan, loc)
+        async with self._lock:
+            file_lst, buffers = await self._send_data_command(cmd, data_format)
+            self._end_command()
+        return await asyncio.get_running_loop().run_in_executor(None, self._finish_waveforms, file_lst, buffers, as_stream, keep_files)
+
+
+    async def _get_event_phase(self, cmd, evids, times=None, lats=None, lons=None, mags=None, depths=None, types=None, gtypes=None, output_file=None):
+        """ Helper function that handles the event and phase commands,
+        which have similar syntax.
+        """
+
+        cmd = utils.make_event_phase_command(cmd, evids, times, lats, lons, mags, depths, types, gtypes, output_file)
+        if self.verbose:
+            print(cmd)
+        self.error = None
+        await self._send(cmd + '\n')
+        await self._receive_data()
+
+
+    async def get_eavail(self, evid, net='', sta='', chan='', loc='', format='s', as_list=True):
+        """ Get the available data for an event.
+        """
+
+        if not self.connected:
+            print('STP is not connected')
+            return None
+
+        cmd = utils.make_eavail_command(evid, net, sta, chan, loc, format)
+        async with self._lock:
+            self.error = None
+            await self._send(cmd)
+            await self._receive_data()
+            eavail_listing = utils.parse_eavail(self.message, format, as_list)
+            self._end_command()
+        return eavail_listing
+
+
+    async def get_events(self, evids=None, times=None, lats=None, lons=None, mags=None, depths=None, types=None, gtypes=None, output_file=None, is_xml=False, as_table=False, lazy=False, raw=False, compact=False):
+        """ Download events from STP using the EVENT command.
+
+        If as_table is True, the events are returned as a NumPy structured
+        array instead of an ObsPy Catalog. If lazy is True, a LazyCatalog
+        is returned, which only creates each Event when it is accessed.
+        If raw is True, the STP output text is returned without being parsed.
+        If compact is True, a tables.EventTable is returned.
+        """
+
+        if not self.connected:
+            print('STP is not connected')
+            return None
+        async with self._lock:
+            await self._get_event_phase('event', evids, times, lats, lons, mags, depths, types, gtypes, output_file)
+            message = self.message
+            self._end_command()
+        return await asyncio.get_running_loop().run_in_executor(None, utils.make_event_result, message, False, as_table, lazy, raw, compact)
+
+
+    async def get_phases(self, evids=None, times=None, lats=None, lons=None, mags=None, depths=None, types=None, gtypes=None, output_file=None, is_xml=False, as_table=False, lazy=False, raw=False, compact=False):
+        """ Download events and phase picks from STP using the PHASE command.
+
+        If as_table is True, a tuple of NumPy structured arrays of events
+        and picks is returned instead of an ObsPy Catalog. If lazy is True,
+        a LazyCatalog is returned, which only creates each Event and its
+        Picks when it is accessed. If raw is True, the STP output text
+        is returned without being parsed. If compact is True, a tuple of
+        a tables.EventTable and a tables.PickTable is returned.
+        """
+
+        if not self.connected:
+            print('STP is not connected')
+            return None
+        async with self._lock:
+            await self._get_event_phase('phase', evids, times, lats, lons, mags, depths, types, gtypes, output_file)
+            message = self.message
+            self._end_command()
+        return await asyncio.get_running_loop().run_in_executor(None, utils.make_event_result, message, True, as_table, lazy, raw, compact)
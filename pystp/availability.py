@@ -0,0 +1,102 @@
+import collections
+import fnmatch
+import threading
+import time
+
+
+def match_channel(channel, net='%', sta='%', chan='%', loc='%'):
+    """ Return whether a [net, sta, chan, loc] channel matches STP
+    patterns, which use % and _ as wildcards. Empty patterns match
+    any value.
+    """
+
+    for value, pattern in zip(channel, [net, sta, chan, loc]):
+        if pattern and pattern != '%' and not fnmatch.fnmatchcase(value, pattern.replace('%', '*').replace('_', '?')):
+            return False
+    return True
+
+
+class AvailabilityIndex:
+    """ An in-memory index of the channels with waveforms for each
+    event, as listed by the STP eavail command.
+
+    Entries expire ttl seconds after they were added, since data for
+    recent events may still be arriving. When max_size is set, the
+    least recently added events are evicted beyond that many entries.
+    """
+
+    def __init__(self, ttl=3600.0, max_size=None):
+        """ Set up a new, empty AvailabilityIndex.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()   # evid: (time added, list of channels)
+        self._lock = threading.Lock()
+
+
+    def get(self, evid):
+        """ Return the list of [net, sta, chan, loc] channels of an event,
+        or None if the event is not in the index or has expired.
+        """
+
+        evid = str(evid)
+        with self._lock:
+            entry = self._entries.get(evid)
+            if entry is None:
+                return None
+            if self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[evid]
+                return None
+            return entry[1]
+
+
+    def put(self, evid, channels):
+        """ Store the list of [net, sta, chan, loc] channels of an event.
+        """
+
+        evid = str(evid)
+        with self._lock:
+            self._entries.pop(evid, None)
+            self._entries[evid] = (time.monotonic(), channels)
+            if self.max_size is not None:
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+
+    def channels(self, evid, net='%', sta='%', chan='%', loc='%'):
+        """ Return the channels of an event that match STP patterns,
+        or None if the event is not in the index.
+        """
+
+        channels = self.get(evid)
+        if channels is None:
+            return None
+        return [c for c in channels if match_channel(c, net, sta, chan, loc)]
+
+
+    def expire(self):
+        """ Remove all expired entries.
+        """
+
+        if self.ttl is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for evid in [evid for evid, entry in self._entries.items() if now - entry[0] > self.ttl]:
+                del self._entries[evid]
+
+
+    def clear(self):
+        """ Remove all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+    def __contains__(self, evid):
+        return self.get(evid) is not None
+
+
+    def __len__(self):
+        self.expire()
+        return len(self._entries)
@@ -0,0 +1,114 @@
+""" Throughput and latency benchmarks of STPClient against the mock STP server.
+
+Run with python -m pystp.benchmark --help for the available options.
+"""
+from __future__ import print_function
+
+import argparse
+import contextlib
+import datetime
+import io
+import time
+
+import numpy as np
+
+from .client import STPClient
+from .mock_server import MockSTPServer
+
+
+def _summarize(name, latencies, nitems, nbytes):
+    """ Summarize the latencies in seconds of repeated calls to one command.
+    """
+
+    total = sum(latencies)
+    return {'command': name,
+            'calls': len(latencies),
+            'events_per_s': nitems / total if total > 0 else 0.0,
+            'mb_per_s': nbytes / total / 1e6 if total > 0 else 0.0,
+            'p50_ms': float(np.percentile(latencies, 50)) * 1000,
+            'p99_ms': float(np.percentile(latencies, 99)) * 1000}
+
+
+def _time_calls(func, repeat):
+    """ Call func(i) repeat times and return the latencies and results.
+    The client's progress output is discarded.
+    """
+
+    latencies = []
+    results = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(repeat):
+            start = time.perf_counter()
+            results.append(func(i))
+            latencies.append(time.perf_counter() - start)
+    return latencies, results
+
+
+def run_benchmarks(server, repeat=20, events_per_query=100, trig_events=5, window_length=600.0, data_format='sac'):
+    """ Run each benchmark against a running MockSTPServer and return
+    a list of result dictionaries with events/s, MB/s and the
+    p50 and p99 latency of each command.
+    """
+
+    client = STPClient(server.host, server.port)
+    client.connect(show_motd=False)
+    client.set_nevntmax(events_per_query)
+    start_time = server.events[0][1]
+    evids = [ev[0] for ev in server.events]
+    results = []
+
+    # get_events and get_phases each return events_per_query events. The
+    # responses reach nevntmax, so splitting is turned off to time one command.
+    latencies, catalogs = _time_calls(lambda i: client.get_events(times=[start_time, start_time + datetime.timedelta(days=3650)], split=False), repeat)
+    results.append(_summarize('get_events', latencies, sum(len(c) for c in catalogs), 0))
+    latencies, catalogs = _time_calls(lambda i: client.get_phases(times=[start_time, start_time + datetime.timedelta(days=3650)], split=False), repeat)
+    results.append(_summarize('get_phases', latencies, sum(len(c) for c in catalogs), 0))
+
+    # get_trig requests trig_events events per call.
+    bytes_before = server.bytes_sent
+    latencies, _ = _time_calls(lambda i: client.get_trig(evids[(i * trig_events) % len(evids):][:trig_events], data_format=data_format), repeat)
+    results.append(_summarize('get_trig', latencies, repeat * trig_events, server.bytes_sent - bytes_before))
+
+    # get_window requests window_length seconds of all channels per call.
+    bytes_before = server.bytes_sent
+    window = datetime.timedelta(seconds=window_length)
+    latencies, _ = _time_calls(lambda i: client.get_window(start_time + i * window, start_time + (i + 1) * window, net='%', sta='%', chan='HH_', data_format=data_format), repeat)
+    results.append(_summarize('get_window', latencies, 0, server.bytes_sent - bytes_before))
+
+    client.disconnect()
+    return results
+
+
+def print_results(results):
+    """ Print benchmark results as a table.
+    """
+
+    print('{:<12} {:>6} {:>10} {:>9} {:>10} {:>10}'.format('command', 'calls', 'events/s', 'MB/s', 'p50 (ms)', 'p99 (ms)'))
+    for r in results:
+        print('{command:<12} {calls:>6} {events_per_s:>10.1f} {mb_per_s:>9.2f} {p50_ms:>10.2f} {p99_ms:>10.2f}'.format(**r))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark pystp against a local mock STP server.')
+    parser.add_argument('--repeat', type=int, default=20, help='Number of calls to each command.')
+    parser.add_argument('--events', type=int, default=100, help='Number of events returned by each event or phase query.')
+    parser.add_argument('--picks', type=int, default=10, help='Number of picks per event.')
+    parser.add_argument('--trig-events', type=int, default=5, help='Number of events per get_trig call.')
+    parser.add_argument('--channels', type=int, default=10, help='Number of channels returned per waveform request.')
+    parser.add_argument('--npts', type=int, default=6000, help='Number of samples per triggered waveform.')
+    parser.add_argument('--window', type=float, default=600.0, help='Length in seconds of each get_window request.')
+    parser.add_argument('--format', default='sac', choices=['sac', 'mseed'], help='Waveform data format.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Server delay in seconds before each response.')
+    parser.add_argument('--bandwidth', type=float, default=None, help='Server bandwidth limit in bytes per second.')
+    args = parser.parse_args(args)
+
+    channels = [('CI', 'S{:03d}'.format(i), 'HHZ', '--') for i in range(args.channels)]
+    server = MockSTPServer(nevents=max(args.events, args.repeat * args.trig_events), picks_per_event=args.picks,
+                           channels=channels, npts=args.npts, latency=args.latency, bandwidth=args.bandwidth)
+    with server:
+        results = run_benchmarks(server, args.repeat, args.events, args.trig_events, args.window, args.format)
+    print_results(results)
+
+
+if __name__ == '__main__':
+    main()
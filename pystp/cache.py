@@ -0,0 +1,156 @@
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class WaveformCache:
+    """ A local on-disk cache of raw waveform files returned by the
+    STP trig and wind commands.
+
+    Files are stored in a content-addressed directory and indexed in
+    an SQLite database by a key made from the request parameters.
+    When max_size (in bytes) is exceeded, the least recently used
+    requests are evicted.
+    """
+
+    def __init__(self, cache_dir, max_size=None):
+        """ Set up a new WaveformCache in cache_dir.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'), check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS requests (key TEXT PRIMARY KEY, last_access REAL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS files (key TEXT, idx INTEGER, name TEXT, digest TEXT, size INTEGER)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS files_key ON files (key)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS files_digest ON files (digest)')
+
+
+    def make_key(self, host, port, cmd, data_format, gain=None):
+        """ Create the cache key for a waveform request. The command
+        includes the event ID or time window and the net/sta/chan/loc
+        selection.
+        """
+
+        params = [host, port, ' '.join(cmd.split()), data_format.lower(), gain]
+        return hashlib.sha256(json.dumps(params).encode('utf-8')).hexdigest()
+
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+
+    def get(self, key):
+        """ Return the list of (name, data) tuples stored for key,
+        or None if the request is not cached.
+        """
+
+        with self._lock:
+            rows = self.db.execute('SELECT last_access FROM requests WHERE key = ?', (key,)).fetchall()
+            if not rows:
+                return None
+            files = self.db.execute('SELECT name, digest FROM files WHERE key = ? ORDER BY idx', (key,)).fetchall()
+            result = []
+            for name, digest in files:
+                try:
+                    with open(self._object_path(digest), 'rb') as f:
+                        result.append((name, f.read()))
+                except OSError:
+                    # A payload file was removed. Treat the request as not cached.
+                    self._delete(key)
+                    self.db.commit()
+                    return None
+            with self.db:
+                self.db.execute('UPDATE requests SET last_access = ? WHERE key = ?', (time.time(), key))
+        return result
+
+
+    def put(self, key, files):
+        """ Store the list of (name, data) tuples returned for a request.
+        """
+
+        with self._lock:
+            rows = []
+            for idx, (name, data) in enumerate(files):
+                digest = hashlib.sha256(data).hexdigest()
+                path = self._object_path(digest)
+                if not os.path.isfile(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+                    with open(tmp_path, 'wb') as f:
+                        f.write(data)
+                    os.replace(tmp_path, path)
+                rows.append((key, idx, name, digest, len(data)))
+            with self.db:
+                self._delete(key)
+                self.db.execute('INSERT INTO requests VALUES (?, ?)', (key, time.time()))
+                self.db.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?)', rows)
+            self._evict()
+
+
+    def _delete(self, key):
+        """ Remove a request from the index, along with any payload
+        files that are no longer used by other requests.
+        """
+
+        digests = [row[0] for row in self.db.execute('SELECT DISTINCT digest FROM files WHERE key = ?', (key,))]
+        self.db.execute('DELETE FROM requests WHERE key = ?', (key,))
+        self.db.execute('DELETE FROM files WHERE key = ?', (key,))
+        for digest in digests:
+            if self.db.execute('SELECT 1 FROM files WHERE digest = ? LIMIT 1', (digest,)).fetchone() is None:
+                path = self._object_path(digest)
+                if os.path.isfile(path):
+                    os.remove(path)
+
+
+    def _evict(self):
+        """ Remove least recently used requests until the cache is
+        no larger than max_size.
+        """
+
+        if self.max_size is None:
+            return
+        with self.db:
+            while self._size() > self.max_size:
+                row = self.db.execute('SELECT key FROM requests ORDER BY last_access LIMIT 1').fetchone()
+                if row is None:
+                    break
+                self._delete(row[0])
+
+
+    def _size(self):
+        row = self.db.execute('SELECT SUM(size) FROM (SELECT DISTINCT digest, size FROM files)').fetchone()
+        return row[0] or 0
+
+
+    def size(self):
+        """ Return the total size in bytes of the cached payload files.
+        """
+
+        with self._lock:
+            return self._size()
+
+
+    def clear(self):
+        """ Remove all requests from the cache.
+        """
+
+        with self._lock:
+            with self.db:
+                for row in self.db.execute('SELECT key FROM requests').fetchall():
+                    self._delete(row[0])
+
+
+    def close(self):
+        """ Close the cache index.
+        """
+
+        self.db.close()
@@ -0,0 +1,162 @@
+""" Command-line bulk downloader for STP.
+
+Run pystp --help, or python -m pystp.cli --help, for the available options.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import sys
+
+from . import utils
+from .client import STPClient, VALID_FORMATS
+from .scheduler import Scheduler
+
+
+def parse_time(text):
+    """ Parse a time given as ISO 8601 or in the STP time format.
+    """
+
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return datetime.datetime.strptime(text, utils.STP_TIME_FORMAT)
+
+
+def _read_lines(path):
+    """ Return the non-empty lines of a file, or of stdin if path is -,
+    without comments starting with #.
+    """
+
+    f = sys.stdin if path == '-' else open(path)
+    try:
+        lines = [line.split('#')[0].strip() for line in f]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return [line for line in lines if line]
+
+
+def read_evids(path):
+    """ Read event IDs separated by whitespace or newlines.
+    """
+
+    return [evid for line in _read_lines(path) for evid in line.split()]
+
+
+def read_manifest(path):
+    """ Read a manifest of time windows with one
+    net sta chan loc start end line per window.
+    Lines that the wind command would reject raise an Exception.
+    """
+
+    windows = []
+    for line in _read_lines(path):
+        fields = line.split()
+        if len(fields) != 6:
+            raise Exception('Invalid manifest line: {}'.format(line))
+        if fields[0] == '%' and fields[1] == '%' and fields[2] == '%':
+            raise Exception('At least one of net/sta/chan is required: {}'.format(line))
+        start, end = parse_time(fields[4]), parse_time(fields[5])
+        if start >= end:
+            raise Exception('The start of a window must be before its end: {}'.format(line))
+        windows.append(fields[:4] + [start, end])
+    return windows
+
+
+def query_evids(args):
+    """ Return the event IDs of the events matching the catalog query options.
+    """
+
+    client = STPClient(args.host, args.port)
+    client.connect(show_motd=False)
+    try:
+        message = client.get_events(times=[args.start, args.end], mags=args.mag, lats=args.lat, lons=args.lon, raw=True)
+    finally:
+        client.disconnect()
+    starts, ends = utils.event_offsets(message)
+    return [message[start:end].split(None, 1)[0] for start, end in zip(starts, ends)]
+
+
+def make_tasks(args):
+    """ Create the Scheduler tasks for the trig or wind command.
+    """
+
+    tasks = []
+    if args.command == 'trig':
+        if args.evids is not None:
+            evids = args.evids
+        elif args.evid_file is not None:
+            evids = read_evids(args.evid_file)
+        else:
+            evids = query_evids(args)
+            print('Found {} events'.format(len(evids)))
+        for evid in evids:
+            def task(client, evid=evid):
+                client.get_trig(evid, args.net, args.sta, args.chan, args.loc, args.radius, args.format, as_stream=False)
+            tasks.append(('trig {}'.format(evid), task))
+    else:
+        for net, sta, chan, loc, start, end in read_manifest(args.manifest):
+            for chunk_start, chunk_end in utils.split_time_range(start, end, args.chunk_length):
+                def task(client, window=(chunk_start, chunk_end, net, sta, chan, loc)):
+                    client.get_window(*window, data_format=args.format, as_stream=False)
+                tasks.append(('wind {} {} {} {} {} {}'.format(net, sta, chan, loc, chunk_start, chunk_end), task))
+    return tasks
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='pystp', description='Download waveforms from the SCEDC STP server in bulk.')
+    parser.add_argument('--host', default='stp.gps.caltech.edu', help='STP server host.')
+    parser.add_argument('--port', type=int, default=9999, help='STP server port.')
+    parser.add_argument('-o', '--output-dir', default='.', help='Directory to write the waveform files to.')
+    parser.add_argument('-f', '--format', default='sac', choices=VALID_FORMATS, help='Waveform data format.')
+    parser.add_argument('-s', '--sessions', type=int, default=4, help='Number of concurrent STP sessions.')
+    parser.add_argument('--rate', type=float, default=None, help='Maximum number of requests per second.')
+    parser.add_argument('--retries', type=int, default=3, help='Number of retries after a connection failure.')
+    parser.add_argument('--retry-delay', type=float, default=5.0, help='Seconds to wait before the first retry, doubled for each retry.')
+    parser.add_argument('--timeout', type=float, default=300.0, help='Socket timeout in seconds.')
+    parser.add_argument('--progress', type=float, default=10.0, help='Seconds between progress reports.')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    trig = commands.add_parser('trig', help='Download triggered waveforms of events.')
+    source = trig.add_mutually_exclusive_group(required=True)
+    source.add_argument('-e', '--evids', nargs='+', help='Event IDs.')
+    source.add_argument('--evid-file', help='File with event IDs, or - for stdin.')
+    source.add_argument('--start', type=parse_time, help='Start of the catalog query for the events.')
+    trig.add_argument('--end', type=parse_time, help='End of the catalog query, default now.')
+    trig.add_argument('--mag', type=float, nargs=2, help='Magnitude range of the catalog query.')
+    trig.add_argument('--lat', type=float, nargs=2, help='Latitude range of the catalog query.')
+    trig.add_argument('--lon', type=float, nargs=2, help='Longitude range of the catalog query.')
+    trig.add_argument('--radius', type=float, default=None, help='Radius around each event in km.')
+    for name in ['net', 'sta', 'chan', 'loc']:
+        trig.add_argument('--' + name, default='%', help='{} pattern, with %% and _ as wildcards.'.format(name))
+
+    wind = commands.add_parser('wind', help='Download continuous waveforms listed in a manifest.')
+    wind.add_argument('manifest', help='File with one "net sta chan loc start end" window per line, or - for stdin.')
+    wind.add_argument('--chunk-length', type=float, default=3600.0, help='Length in seconds of each wind request.')
+    return parser
+
+
+def main(args=None):
+    args = make_parser().parse_args(args)
+    if args.command == 'trig' and args.start is not None and args.end is None:
+        args.end = datetime.datetime.utcnow()
+
+    tasks = make_tasks(args)
+    scheduler = Scheduler(args.host, args.port, args.sessions, args.output_dir, args.rate, args.retries,
+                          args.retry_delay, args.timeout, args.progress, args.verbose)
+    result = scheduler.run(tasks)
+    for command, totals in sorted(result['stats'].items()):
+        print('{}: {} commands, {:.1f} MB, {:.2f} MB/s, {:.3f} s mean'.format(
+            command, totals['count'], totals['bytes_received'] / 1e6, totals['bytes_per_s'] / 1e6, totals['mean_time']))
+    for label, error in result['failed']:
+        print('Failed: {}: {}'.format(label, error))
+    if result['unfinished']:
+        print('{} tasks were not run'.format(result['unfinished']))
+    return 1 if result['failed'] or result['unfinished'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,30 +2,56 @@ from __future__ import print_function
 
 import socket
 import struct
-import re
 import os
-import obspy.core
-from obspy.core import Stream
-from obspy.core.event import Catalog
+import io
+import collections
+import time
 from . import utils
+from .availability import match_channel
+from .prefetch import TrigPrefetcher
+from .stats import ClientStats, CommandStats
 
 VALID_FORMATS = ['sac', 'mseed', 'seed', 'ascii', 'v0', 'v1']
 
+# Size of the reusable buffer that DATA blocks are read into.
+RECV_BUFFER_SIZE = 65536
+
 class STPClient:
     
-    def __init__(self, host='stp.gps.caltech.edu', port=9999, output_dir='.', verbose=False):
+    def __init__(self, host='stp.gps.caltech.edu', port=9999, output_dir='.', verbose=False, cache=None, decode_executor=None, availability=None):
         """ Set up a new STPClient object.
+
+        cache is an optional WaveformCache used by get_trig and get_window.
+        decode_executor is an optional concurrent.futures executor used to
+        decode waveform files while the rest of a response is received.
+        availability is an optional AvailabilityIndex used by get_availability.
         """
         self.host = host
         self.port = port
         self.socket = None
         self.fdr = None      # File handle to the socket
         self.fdout = None    # Output file handle
-        self.output_dir = '.'
+        self._recv_view = memoryview(bytearray(RECV_BUFFER_SIZE))
+        self.base_output_dir = output_dir
+        self.output_dir = output_dir
         self.message = ''  # Most recent message from the server
         self.motd = ''     # Message of the Day
         self.verbose = verbose
         self.connected = False
+        self.error = None    # Most recent error message from the server
+        self.data_format = None  # Waveform data format set on the server
+        self.gaincorr = None # Gain correction setting, if changed from the server default
+        self.nevntmax = None # Maximum number of events per query, set when connecting
+        self.truncated = False  # True if the last event or phase query may be missing events
+        self.timeout = None  # Socket timeout in seconds
+        self.last_files = [] # Files returned by the most recent waveform request
+        self.cache = cache
+        self.decode_executor = decode_executor
+        self.availability = availability
+        self._decode_futures = None  # Decoding results of the files of the current response
+        self.stats = ClientStats()   # Totals of the measurements of each command
+        self.hooks = []              # Functions called with the CommandStats of each command
+        self._stats = None           # CommandStats of the current command
         
 
     def _send_sample(self):
@@ -42,15 +68,35 @@ class STPClient:
         by MESS and ENDmess.
         """
 
-        message = ''
+        lines = []
         while True:
             line = self.fdr.readline()
+            if self._stats is not None:
+                self._stats.bytes_received += len(line)
 
             if not line or line == b'OVER\n' or line == b'ENDmess\n':
                 break
             
-            message += line.decode('ascii')
-        return message
+            lines.append(line)
+        return b''.join(lines).decode('ascii')
+
+
+    def _read_data(self, ndata):
+        """ Read a DATA block of ndata bytes into the reusable receive
+        buffer and write it to the current output.
+        """
+
+        if self._stats is not None:
+            self._stats.ndata += 1
+            self._stats.bytes_received += ndata
+        view = self._recv_view
+        while ndata > 0:
+            nread = self.fdr.readinto(view[:min(ndata, len(view))])
+            if not nread:
+                break
+            if self.fdout:
+                self.fdout.write(view[:nread])
+            ndata -= nread
 
 
     def _process_error(self, fields):
@@ -58,6 +104,9 @@ class STPClient:
         """
 
         err_msg = ' '.join(fields[1:])
+        self.error = err_msg
+        if self._stats is not None:
+            self._stats.error = err_msg
         print(err_msg)
         
 
@@ -77,19 +126,51 @@ class STPClient:
 
         
 
-    def _receive_data(self, dir_lst=[], file_lst=[]):
+    def _close_output(self):
+        """ Close the current output file. In-memory buffers are left
+        open so that they can still be decoded.
+        """
+
+        if self.fdout is None:
+            return
+        if not isinstance(self.fdout, io.BytesIO):
+            self.fdout.close()
+        if self._decode_futures is not None:
+            # The file is complete, so it can be decoded while receiving continues.
+            if isinstance(self.fdout, io.BytesIO):
+                payload = self.fdout.getvalue()
+            else:
+                payload = self.fdout.name
+            self._decode_futures.append(self.decode_executor.submit(utils.read_payload, payload))
+        self.fdout = None
+
+
+    def _receive_data(self, dir_lst=[], file_lst=[], buffers=None):
         """ Process results sent by the STP server.
+
+        If buffers is a dict, the contents of each FILE are collected
+        in a BytesIO keyed by the file path instead of being written to disk.
+        Returns False if the connection was closed before OVER was received.
         """
 
         if self.verbose:
             print("STPClient._receive_data()")
+        messages = []   # Text of MESS blocks, joined into self.message at the end
+        stats = self._stats
         while True:
             line = self.fdr.readline()
+            if stats is not None:
+                if stats.time_to_first_byte is None:
+                    stats.time_to_first_byte = stats.elapsed()
+                stats.bytes_received += len(line)
             if self.verbose:
                 print('_receive_data: Received line ', line)
             if not line:
-                self.output_dir = '.'
-                break
+                self.output_dir = self.base_output_dir
+                self.message += ''.join(messages)
+                if stats is not None:
+                    stats.transfer_time = stats.elapsed()
+                return False
             
             line_words = line.decode('ascii').split()
             if len(line_words) == 0:
@@ -98,12 +179,21 @@ class STPClient:
                 print('_receive_data: ', line_words)
 
             if line_words[0] == 'OVER':
-                self.output_dir = '.'
-                break
+                self.output_dir = self.base_output_dir
+                self.message += ''.join(messages)
+                if stats is not None:
+                    stats.transfer_time = stats.elapsed()
+                return True
             elif line_words[0] == 'FILE':
-                if self.fdout:
-                    self.fdout.close()
+                self._close_output()
+                if stats is not None:
+                    stats.nfiles += 1
                 outfile = os.path.join(self.output_dir, line_words[1])
+                if buffers is not None:
+                    self.fdout = io.BytesIO()
+                    buffers[outfile] = self.fdout
+                    file_lst.append(outfile)
+                    continue
                 if self.verbose:
                     print('Opening {} for writing'.format(outfile))
                 self.fdout = open(outfile, 'wb')
@@ -114,21 +204,14 @@ class STPClient:
             elif line_words[0] == 'DIR':
                 # Create output directory
                 self.output_dir = os.path.join(self.output_dir, line_words[1])
-                if not os.path.isdir(self.output_dir):
+                if buffers is None and not os.path.isdir(self.output_dir):
                     os.mkdir(self.output_dir)
                     dir_lst.append(self.output_dir)
             elif line_words[0] == 'MESS':
-                msg = self._read_message()
-                self.message += msg
-                #print(msg, end='')
+                messages.append(self._read_message())
             
             elif line_words[0] == 'DATA':
-                ndata = int(line_words[1])
-                # Read ndata bytes.
-                data = self.fdr.read(ndata)
-                # Write ndata bytes to the output file handle.
-                if self.fdout:
-                    self.fdout.write(data)
+                self._read_data(int(line_words[1]))
             elif line_words[0] == 'ENDdata':
                 continue
             elif line_words[0] == 'ERR':
@@ -142,20 +225,88 @@ class STPClient:
     def set_output_dir(self, output_dir):
         """ Change the base output directory.
         """
+        self.base_output_dir = output_dir
         self.output_dir = output_dir
 
 
+    def set_cache(self, cache):
+        """ Set the WaveformCache used by get_trig and get_window,
+        or None to disable caching.
+        """
+        self.cache = cache
+
+
+    def set_availability(self, availability):
+        """ Set the AvailabilityIndex used by get_availability,
+        or None to disable it.
+        """
+        self.availability = availability
+
+
+    def add_hook(self, hook):
+        """ Register a function to be called with the CommandStats of
+        each command after it is completed.
+        """
+        self.hooks.append(hook)
+
+
+    def remove_hook(self, hook):
+        """ Unregister a function added with add_hook.
+        """
+        self.hooks.remove(hook)
+
+
+    def _start_stats(self, command):
+        """ Start measuring a command.
+        """
+
+        self._stats = CommandStats(command)
+        return self._stats
+
+
+    def _finish_stats(self, stats):
+        """ Record the measurements of a completed command and pass them
+        to the registered hooks.
+        """
+
+        stats.total_time = stats.elapsed()
+        if self._stats is stats:
+            self._stats = None
+        self.stats.record(stats)
+        for hook in self.hooks:
+            hook(stats)
+
+
+    def set_decode_executor(self, executor):
+        """ Set the concurrent.futures executor, such as a ProcessPoolExecutor,
+        used to decode waveform files, or None to decode them on the calling thread.
+        """
+        self.decode_executor = executor
+
+
     def set_nevntmax(self, value=100):
         """ Set the value of the nevntmax parameter, the maximum 
         number of events returned by the event command.
         """
         self.socket.sendall('set nevntmax {}\n'.format(value).encode('utf-8'))
+        self.nevntmax = value
         self.fdr.readline()
+
+
+    def set_timeout(self, timeout):
+        """ Set the socket timeout in seconds, or None to wait indefinitely.
+        A timeout raises socket.timeout and leaves the session unusable
+        until it is reconnected.
+        """
+        self.timeout = timeout
+        if self.socket:
+            self.socket.settimeout(timeout)
     
     def set_gaincorr(self, value='on'):
         """ Set the value of the gain parameter to on or off.
         """
         self.socket.sendall('gain {}\n'.format(value).encode('utf-8'))
+        self.gaincorr = value
         line = self.fdr.readline()
         if line == b'MESS\n':
             self.message = self._read_message()
@@ -177,66 +328,229 @@ class STPClient:
             print('Already connected')
             return
 
+        stats = self._start_stats('connect')
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.settimeout(self.timeout)
         self.socket.connect((self.host, self.port))
         self.fdr = self.socket.makefile(mode='rb')
 
         self.socket.sendall(b'STP stpisgreat 1.6.3 stpc\n')
        
         line = self.fdr.readline()
+        stats.time_to_first_byte = stats.elapsed()
+        stats.bytes_received += len(line)
         if line != b'CONNECTED\n':
             print(line)
             raise Exception('Failed to connect')
 
         self._send_sample()
 
+        self.data_format = None
         self._set_motd()
         if show_motd:
             print(self.motd, end='')
+        # Set nevntmax so that truncated event and phase responses can be
+        # detected, keeping the value of a reconnected session.
+        self.set_nevntmax(self.nevntmax if self.nevntmax is not None else utils.DEFAULT_NEVNTMAX)
         self.connected = True
         self._clear_message()
+        stats.transfer_time = stats.elapsed()
+        self._finish_stats(stats)
     
 
-    def _send_data_command(self, cmd, data_format, as_stream=True, keep_files=False):
-        """ Send a waveform request command and process the results.
+    def _check_data_format(self, data_format):
+        """ Return the waveform data format in lower case, raising an
+        exception if it is not valid.
         """
 
         data_format = data_format.lower()
         if data_format not in VALID_FORMATS:
             raise Exception('Invalid data format')
-        if self.verbose:
-            print("data_format={} cmd={}".format(data_format, cmd))
+        return data_format
+
+
+    def _set_data_format(self, data_format):
+        """ Send the waveform data format to the server unless it is
+        already the format of this session.
+        """
+
+        data_format = self._check_data_format(data_format)
+        if data_format == self.data_format:
+            return data_format
+
+        self.error = None
+        self.socket.sendall('{}\n'.format(data_format).encode('utf-8'))
+        if self._receive_data([], [], {}) and self.error is None:
+            self.data_format = data_format
+        return data_format
+
 
+    def _lookup_cache(self, cmd, data_format):
+        """ Return the cache key of a waveform request and the cached
+        files, which are None if the request is not cached.
+        """
+
+        if self.cache is None:
+            return None, None
+        cache_key = self.cache.make_key(self.host, self.port, cmd, data_format, self.gaincorr)
+        cached = self.cache.get(cache_key)
+        if cached is not None and self.verbose:
+            print('Using cached results for {}'.format(cmd.strip()))
+        return cache_key, cached
+
+
+    def _make_cached_result(self, cached, as_stream, keep_files, stats):
+        """ Create the result of a waveform request from cached files.
+        """
+
+        self._stats = stats
+        stats.cached = True
+        file_lst = [os.path.join(self.base_output_dir, name) for name, data in cached]
+        buffers = {f: io.BytesIO(data) for f, (name, data) in zip(file_lst, cached)}
+        result = self._make_waveform_result(file_lst, buffers, as_stream, keep_files)
+        self._finish_stats(stats)
+        return result
+
+
+    def _receive_waveforms(self, cache_key, as_stream, keep_files, stats):
+        """ Receive the results of a waveform request command
+        that has already been sent.
+        """
+
+        self._stats = stats
         file_lst = []
         dir_lst = []
-        self.socket.sendall('{}\n'.format(data_format).encode('utf-8'))
-        self._receive_data(dir_lst, file_lst)
+        buffers = None
+        if cache_key is not None or (as_stream and not keep_files):
+            buffers = {}
+        self.error = None
+        futures = None
+        if as_stream and self.decode_executor is not None:
+            futures = []
+        self._decode_futures = futures
+        try:
+            complete = self._receive_data(dir_lst, file_lst, buffers)
+            self._close_output()
+        finally:
+            self._decode_futures = None
+        if not complete:
+            self.connected = False
+            raise ConnectionError('Connection to the STP server was closed before the end of the response')
+
+        # Responses without files are not cached, since data for recent
+        # events and time windows may still arrive.
+        if cache_key is not None and complete and self.error is None and file_lst:
+            self.cache.put(cache_key, [(os.path.relpath(f, self.base_output_dir), buffers[f].getbuffer()) for f in file_lst])
+        result = self._make_waveform_result(file_lst, buffers, as_stream, keep_files, futures)
+        self._finish_stats(stats)
+        return result
+
+
+    def _send_data_command(self, cmd, data_format, as_stream=True, keep_files=False):
+        """ Send a waveform request command and process the results.
+
+        When the results are returned as a Stream and the files are
+        not kept, the waveforms are decoded from memory without being
+        written to disk. Cached results are returned without contacting
+        the server, even if the client is not connected. Otherwise None
+        is returned if the client is not connected.
+        """
+
+        if self.verbose:
+            print("data_format={} cmd={}".format(data_format, cmd))
+        data_format = self._check_data_format(data_format)
+        stats = CommandStats(cmd.split()[0])
+        cache_key, cached = self._lookup_cache(cmd, data_format)
+        if cached is not None:
+            return self._make_cached_result(cached, as_stream, keep_files, stats)
+        if not self.connected:
+            print('STP is not connected')
+            return None
+
+        self._set_data_format(data_format)
         self.socket.sendall(cmd.encode('utf-8'))
-        self._receive_data(dir_lst, file_lst)        
+        return self._receive_waveforms(cache_key, as_stream, keep_files, stats)
 
-        waveform_stream = None
-        if as_stream:
-            waveform_stream = Stream()
-            ntraces = 0
+
+    def _iter_data_commands(self, cmds, data_format, as_stream=True, keep_files=False, pipeline=1):
+        """ Send waveform request commands and yield (cmd, result) for each
+        in order.
+
+        With pipeline greater than 1, up to that many commands are written
+        to the server ahead of their responses, which are read back in the
+        order the commands were sent. As in _send_data_command, cached
+        results are used without contacting the server, and the result
+        of other commands is None if the client is not connected.
+        """
+
+        if pipeline <= 1:
+            for cmd in cmds:
+                yield cmd, self._send_data_command(cmd, data_format, as_stream, keep_files)
+            return
+
+        data_format = self._check_data_format(data_format)
+        cmds = iter(cmds)
+        pending = collections.deque()   # (cmd, cache_key, cached, sent, stats) of requests awaiting results
+        nsent = 0                       # Number of pending requests that were sent to the server
+        try:
+            while True:
+                while nsent < pipeline:
+                    cmd = next(cmds, None)
+                    if cmd is None:
+                        break
+                    stats = CommandStats(cmd.split()[0])
+                    cache_key, cached = self._lookup_cache(cmd, data_format)
+                    sent = cached is None and self.connected
+                    if sent:
+                        self._set_data_format(data_format)
+                        if self.verbose:
+                            print("data_format={} cmd={}".format(data_format, cmd))
+                        self.socket.sendall(cmd.encode('utf-8'))
+                        nsent += 1
+                    pending.append((cmd, cache_key, cached, sent, stats))
+                if not pending:
+                    break
+                cmd, cache_key, cached, sent, stats = pending.popleft()
+                if cached is not None:
+                    yield cmd, self._make_cached_result(cached, as_stream, keep_files, stats)
+                elif sent:
+                    nsent -= 1
+                    yield cmd, self._receive_waveforms(cache_key, as_stream, keep_files, stats)
+                else:
+                    print('STP is not connected')
+                    yield cmd, None
+        except GeneratorExit:
+            # Read and discard the responses to commands that were already
+            # sent so that the session stays in sync.
+            for i in range(nsent):
+                self._receive_data([], [], {})
+                self._close_output()
+            raise
+
+
+    def _make_waveform_result(self, file_lst, buffers, as_stream, keep_files, futures=None):
+        """ Write in-memory waveform files to disk if they are to be kept
+        and read them into a Stream if requested. futures are the results
+        of files already submitted to the decode executor.
+        """
+
+        self.last_files = file_lst
+        if buffers is not None and (keep_files or not as_stream):
             for f in file_lst:
-                try:
-                    if self.verbose:
-                        print('Reading {}'.format(f))
-                    tr = obspy.core.read(f)
-                    waveform_stream += tr
-                    ntraces += 1
-                except TypeError:
-                    if self.verbose:
-                        print('{} is in unknown format. Skipping.'.format(f))
-                        
-
-                if not keep_files:
-                    if self.verbose:
-                        print("Removing {} after reading".format(f))
-                    if os.path.isfile(f):
-                        os.remove(f)
-            print('Processed {} waveform traces'.format(ntraces))
-            
+                os.makedirs(os.path.dirname(f) or '.', exist_ok=True)
+                with open(f, 'wb') as fdout:
+                    fdout.write(buffers[f].getbuffer())
+
+        waveform_stream = None
+        decode_start = time.perf_counter()
+        if as_stream and futures is None and self.decode_executor is not None and buffers is not None:
+            futures = [self.decode_executor.submit(utils.read_payload, buffers[f].getvalue()) for f in file_lst]
+        if as_stream and futures is not None:
+            waveform_stream = utils.gather_stream(file_lst, futures, self.verbose)
+        elif as_stream:
+            waveform_stream = utils.make_stream(file_lst, buffers, keep_files, self.verbose)
+        if self._stats is not None:
+            self._stats.decode_time = time.perf_counter() - decode_start
         return waveform_stream
 
 
@@ -244,60 +558,97 @@ class STPClient:
         """ Perform cleanup after an STP command is ended.
         """
 
-        if self.fdout:
-            self.fdout.close()
+        self._close_output()
         self._clear_message()
 
     def _clear_message(self):
         self.message = ''
 
-    def get_trig(self, evids, net='%', sta='%', chan='%', loc='%', radius=None,  data_format='sac', as_stream=True, keep_files=False):
+    def iter_trig(self, evids, net='%', sta='%', chan='%', loc='%', radius=None, data_format='sac', as_stream=True, keep_files=False, pipeline=1, use_availability=False, sink=None):
+        """ Download triggered waveforms from STP using the TRIG command,
+        yielding (evid, Stream) as soon as each event is received.
+        No reference to an event's waveforms is kept after it is yielded.
+
+        With pipeline greater than 1, up to that many trig commands are
+        sent ahead of the responses to hide the network round trip time.
+        If use_availability is True, the available channels are looked up
+        first with get_availability and no trig command is sent for events
+        without matching channels, which get an empty result instead.
+        If sink is an HDF5Sink, each event's Stream is written to it
+        as soon as it is received.
+
+        Cached waveforms are returned even if the client is not connected,
+        and the Stream of other events is None.
+        """
+
+        if use_availability and not self.connected:
+            print('STP is not connected')
+            return
+
+        if not isinstance(evids, list):
+            evids = [evids]
+        if sink is not None:
+            as_stream = True
+        available = None
+        requested = evids
+        if use_availability:
+            available = self.get_availability(evids, net, sta, chan, loc, max(pipeline, 16))
+            requested = [evid for evid in evids if available[evid]]
+        cmds = (utils.make_trig_command(evid, net, sta, chan, loc, radius) for evid in requested)
+        results = self._iter_data_commands(cmds, data_format, as_stream, keep_files, pipeline)
+        try:
+            for evid in evids:
+                if available is not None and not available[evid]:
+                    yield evid, self._make_waveform_result([], None, as_stream, keep_files)
+                    continue
+                cmd, st = next(results)
+                if sink is not None and st is not None:
+                    sink.write(st, event_id=evid)
+                yield evid, st
+                # Drop the reference before the next event is received.
+                st = None
+        finally:
+            results.close()
+            self._end_command()
+
+
+    def get_trig(self, evids, net='%', sta='%', chan='%', loc='%', radius=None,  data_format='sac', as_stream=True, keep_files=False, pipeline=1, use_availability=False, sink=None):
         """ Download triggered waveforms from STP using the TRIG command.
+        See iter_trig for pipeline, use_availability and sink. With a
+        sink, the Streams are not kept and the values of the returned
+        dictionary are None.
         """
 
-        if not self.connected:
+        if use_availability and not self.connected:
             print('STP is not connected')
             return None
 
-        base_cmd = 'trig '
-        if net != '%':
-            base_cmd += ' -net {}'.format(net)
-        if sta != '%':
-            base_cmd += ' -sta {}'.format(sta)
-        if chan != '%':
-            base_cmd += ' -chan {}'.format(chan)
-        if loc != '%':
-            base_cmd += ' -loc {}'.format(loc)
-        if radius is not None:
-            base_cmd += ' -radius {}'.format(radius)
-        
-        result = {}
+        results = self.iter_trig(evids, net, sta, chan, loc, radius, data_format, as_stream, keep_files, pipeline, use_availability, sink)
+        if sink is not None:
+            return {evid: None for evid, st in results}
+        return dict(results)
 
-        def request_event(evid):
-            cmd = "{} {}\n".format(base_cmd, evid)
-            result[evid] = self._send_data_command(cmd, data_format, as_stream, keep_files)
 
-        if isinstance(evids, list):
-            for ev in evids:
-                #cmd = "{} {}\n".format(base_cmd, ev)
-                #result[ev] = self._send_data_command(cmd, data_format, as_stream, keep_files)
-                request_event(ev)
-        else:
-            request_event(evids)
-        
-        self._end_command()
-        
-        return result
+    def prefetch_trig(self, events, net='%', sta='%', chan='%', loc='%', radius=None, data_format='sac', as_stream=True, keep_files=False, read_ahead=4, max_bytes=None, pipeline=1, use_availability=False):
+        """ Return a TrigPrefetcher that yields (evid, Stream) for the events
+        of a Catalog, LazyCatalog, EventTable, raw get_events output or list
+        of event IDs, downloading the next read_ahead events, up to max_bytes
+        of waveform data, in the background while each event is processed.
+        The client must not be used for anything else during the iteration.
+        """
+
+        return TrigPrefetcher(self, events, net, sta, chan, loc, radius, data_format, as_stream, keep_files,
+                              read_ahead, max_bytes, pipeline, use_availability)
 
-    def get_window(self, start_time, end_time, net='%', sta='%', chan='%', loc='%', data_format='sac', as_stream=True, keep_files=False):
+    def get_window(self, start_time, end_time, net='%', sta='%', chan='%', loc='%', data_format='sac', as_stream=True, keep_files=False, sink=None):
         """ Download continuous waveforms from STP using the WIND command.
         positional params expected by WIND:
             net sta chan loc time_on, time_off
+        If sink is an HDF5Sink, the waveforms are written to it and
+        None is returned. Cached waveforms are returned even if the
+        client is not connected.
         """
 
-        if not self.connected:
-            print('STP is not connected')
-            return None
         if not start_time or not end_time:
             print ('Time range is required')
             return None
@@ -306,54 +657,112 @@ class STPClient:
             print ('At least one of net/sta/chan is required.' )
             return None
 
-        start = start_time.strftime("%Y/%m/%d,%H:%M:%S.%f")
-        end = end_time.strftime("%Y/%m/%d,%H:%M:%S.%f")
+        base_cmd = utils.make_wind_command(start_time, end_time, net, sta, chan, loc)
+        result = self._send_data_command(base_cmd, data_format, as_stream or sink is not None, keep_files)
+        self._end_command()
+        if sink is not None and result is not None:
+            sink.write(result)
+            return None
+        return result
+
+
+    def get_windows(self, requests, data_format='sac', merge_components=False, max_gap=0.0, pipeline=4):
+        """ Download continuous waveforms for many (net, sta, chan, loc,
+        start, end) requests, such as a list of stations. The requests
+        are combined into as few WIND commands as possible with
+        utils.coalesce_windows, and up to pipeline commands are sent
+        ahead of their responses. Returns a dictionary with the request
+        tuples as keys and the Stream of each request as values.
+        """
+
+        if not self.connected:
+            print('STP is not connected')
+            return None
 
-        base_cmd = f'wind {net} {sta} {chan} {loc} {start} {end} \n'
-        result = self._send_data_command(base_cmd, data_format, as_stream, keep_files)
+        windows = utils.coalesce_windows(requests, merge_components, max_gap)
+        if self.verbose:
+            print('Requesting {} windows with {} commands'.format(len(requests), len(windows)))
+        cmds = [utils.make_wind_command(start, end, net, sta, chan, loc) for net, sta, chan, loc, start, end, members in windows]
+        result = {}
+        for window, (cmd, st) in zip(windows, self._iter_data_commands(cmds, data_format, True, False, pipeline)):
+            for request in window[6]:
+                result[request] = utils.select_window(st, *request)
         self._end_command()
         return result
 
 
-    def get_continuous(self, net='%', sta='%', chan='%', loc='%', data_format='sac', as_stream=True, keep_files=False):
-        pass
+    def get_continuous(self, start_time, end_time, net='%', sta='%', chan='%', loc='%', data_format='sac', as_stream=True, keep_files=False, chunk_length=3600, sessions=1, fill_value=None, pipeline=1, sink=None):
+        """ Download continuous waveforms for a long time range by splitting
+        it into chunks of chunk_length seconds (or a timedelta), each of which
+        is requested with the WIND command.
+
+        If sessions is greater than 1, the chunks are downloaded concurrently
+        over that many connections. The traces of each channel are merged into
+        a single Stream, with gaps filled with fill_value or masked if
+        fill_value is None. With as_stream=False, each chunk is written to
+        output_dir as it arrives and nothing is kept in memory. With a single
+        session, pipeline sets how many chunk requests are sent ahead of
+        their responses. If sink is an HDF5Sink, each chunk is written to
+        it as it arrives and None is returned.
+        """
+
+        if not self.connected:
+            print('STP is not connected')
+            return None
+        if not start_time or not end_time:
+            print ('Time range is required')
+            return None
+        if net=='%' and sta=='%' and chan=='%':
+            print ('At least one of net/sta/chan is required.' )
+            return None
+
+        if sessions > 1:
+            # Imported here because the pool module depends on this one.
+            from .pool import STPClientPool
+            pool = STPClientPool(self.host, self.port, sessions, self.base_output_dir, self.verbose, self.cache, self.decode_executor)
+            pool.set_timeout(self.timeout)
+            pool.connect(show_motd=False)
+            try:
+                # Use the settings of this session on the new ones.
+                if self.gaincorr is not None:
+                    pool.set_gaincorr(self.gaincorr)
+                if self.nevntmax is not None:
+                    pool.set_nevntmax(self.nevntmax)
+                return pool.get_continuous(start_time, end_time, net, sta, chan, loc, data_format, as_stream, keep_files, chunk_length, fill_value=fill_value, sink=sink)
+            finally:
+                pool.disconnect()
+
+        chunks = utils.split_time_range(start_time, end_time, chunk_length)
+        cmds = [utils.make_wind_command(chunk_start, chunk_end, net, sta, chan, loc) for chunk_start, chunk_end in chunks]
+        streams = []
+        for cmd, st in self._iter_data_commands(cmds, data_format, as_stream or sink is not None, keep_files, pipeline):
+            if sink is not None:
+                sink.write(st)
+            elif as_stream:
+                streams.append(st)
+        self._end_command()
+        if not as_stream or sink is not None:
+            return None
+        return utils.merge_streams(streams, fill_value)
 
 
     def _get_event_phase(self, cmd, evids, times=None, lats=None, lons=None, mags=None, depths=None, types=None, gtypes=None, output_file=None, is_xml=False):
         """ Helper function that handles the event and phase commands, 
-        which have similar syntax.
+        which have similar syntax. Returns the CommandStats of the command,
+        which the caller finishes after parsing the results.
         """
 
-        if output_file is not None:
-            cmd += ' -f {} '.format(output_file)
-        if evids is not None:
-            evids_str = [str(e) for e in evids]
-            cmd += ' -e {} '.format(' '.join(evids_str))
-        else:
-            if times is not None:
-                start_time = times[0].strftime("%Y/%m/%d,%H:%M:%S.%f")
-                end_time = times[1].strftime("%Y/%m/%d,%H:%M:%S.%f")
-                cmd += ' -t0 {} {}'.format(start_time, end_time)
-            if lats is not None:
-                cmd += ' -lat {} {}'.format(lats[0], lats[1])
-            if lons is not None:
-                cmd += ' -lon {} {}'.format(lons[0], lons[1])
-            if mags is not None:
-                cmd += ' -mag {} {}'.format(mags[0], mags[1])
-            if depths is not None:
-                cmd += ' -depth {} {}'.format(depths[0], depths[1])
-            if types is not None:
-                cmd += ' -type {} '.format(','.join(types))
-            if gtypes is not None:
-                cmd += ' -gtype {} '.format(','.join(gtypes))
-            
+        cmd = utils.make_event_phase_command(cmd, evids, times, lats, lons, mags, depths, types, gtypes, output_file)
         if self.verbose:
             print(cmd)
         cmd += '\n'
         if self.verbose:
             print('Sending command')
+        stats = self._start_stats(cmd.split()[0])
+        self.error = None
         self.socket.send(cmd.encode('utf-8'))
         self._receive_data()
+        return stats
         
     
     def get_eavail(self, evid, net='', sta='', chan='', loc='', format='s', as_list=True):
@@ -364,94 +773,230 @@ class STPClient:
             print('STP is not connected')
             return None
 
-        cmd = 'eavail'
-       
-        if net != '':
-            cmd += ' -net {}'.format(net)
-        if sta != '':
-            cmd += ' -sta {}'.format(sta)
-        if chan != '':
-            cmd += ' -chan {}'.format(chan)
-        if loc != '':
-            cmd += ' -loc {}'.format(loc)
-        if format == 'l' or format == 'long':
-            cmd += ' -l'
-        
-        cmd += ' ' + str(evid)
-        cmd += '\n'
+        cmd = utils.make_eavail_command(evid, net, sta, chan, loc, format)
         if self.verbose:
             print(cmd)
+        stats = self._start_stats('eavail')
+        self.error = None
         self.socket.send(cmd.encode('utf-8'))
         self._receive_data()
 
-        if as_list:
-            # Remove the comment with the number of seismograms, which will not be part of the list.
-            self.message = self.message.split('#')[0]
-            
-        if as_list and (format == 'l' or format== 'long'):
-            eavail_listing = [line.strip().split() for line in self.message.split('\n') if not line.strip().startswith('#') and not line == '']
-        elif as_list and (format == 's' or format == 'short'):
-            eavail_listing = [line.strip().split('.') for line in self.message.split() if not line.strip().startswith('#') and not line == '']
-        else:
-            eavail_listing = self.message
+        parse_start = time.perf_counter()
+        eavail_listing = utils.parse_eavail(self.message, format, as_list)
+        stats.parse_time = time.perf_counter() - parse_start
         self._end_command()
+        self._finish_stats(stats)
         return eavail_listing
+
+
+    def get_availability(self, evids, net='%', sta='%', chan='%', loc='%', pipeline=16):
+        """ Get the channels with data for many events. Returns a dictionary
+        with event IDs as keys and lists of [net, sta, chan, loc] as values.
+
+        Events in the client's AvailabilityIndex are not requested again.
+        The other events are requested with eavail commands for all of
+        their channels, up to pipeline at a time ahead of the responses,
+        and added to the index. The channels are then filtered locally.
+        """
+
+        if not self.connected:
+            print('STP is not connected')
+            return None
+
+        if not isinstance(evids, list):
+            evids = [evids]
+        result = {}
+        missing = []
+        for evid in evids:
+            channels = self.availability.get(evid) if self.availability is not None else None
+            if channels is None:
+                missing.append(evid)
+            else:
+                result[evid] = channels
+
+        missing = iter(missing)
+        pending = collections.deque()   # (evid, stats) of commands awaiting results
+        while True:
+            while len(pending) < max(pipeline, 1):
+                evid = next(missing, None)
+                if evid is None:
+                    break
+                cmd = utils.make_eavail_command(evid, format='l')
+                if self.verbose:
+                    print(cmd)
+                self.socket.sendall(cmd.encode('utf-8'))
+                pending.append((evid, CommandStats('eavail')))
+            if not pending:
+                break
+
+            evid, stats = pending.popleft()
+            self._stats = stats
+            self.error = None
+            if not self._receive_data():
+                self.connected = False
+                raise ConnectionError('Connection to the STP server was closed before the end of the response')
+            parse_start = time.perf_counter()
+            channels = utils.parse_eavail(self.message, 'l')
+            stats.parse_time = time.perf_counter() - parse_start
+            self._end_command()
+            self._finish_stats(stats)
+            if self.error is None and self.availability is not None:
+                self.availability.put(evid, channels)
+            result[evid] = channels
+
+        return {evid: [c for c in result[evid] if match_channel(c, net, sta, chan, loc)] for evid in evids}
     
             
-    def get_events(self, evids=None, times=None, lats=None, lons=None, mags=None, depths=None, types=None, gtypes=None, output_file=None, is_xml=False):
+    def _query_part(self, cmd, evids, times, lats, lons, mags, depths, types, gtypes, output_file, split):
+        """ Run one event or phase query. Returns its output, its unfinished
+        CommandStats and, if split is True and the output reached nevntmax
+        events and so may be truncated, the two halves that the query
+        should be replaced by. Otherwise the halves are None. Sets
+        self.truncated if the output reached nevntmax and was not split.
+        """
+
+        stats = self._get_event_phase(cmd, evids, times, lats, lons, mags, depths, types, gtypes, output_file)
+        message = self.message
+        self._end_command()
+        halves = None
+        limit = self.nevntmax
+        if limit is not None and evids is None and output_file is None and self.error is None:
+            if len(utils.event_offsets(message, cmd == 'phase')[0]) >= limit:
+                if split:
+                    halves = utils.bisect_query(times, lats, lons)
+                    if halves is None:
+                        print('Warning: the {} query returned {} events and could not be split, some events may be missing'.format(cmd, limit))
+                if halves is None:
+                    self.truncated = True
+        return message, halves, stats
+
+
+    def _query_events(self, cmd, evids, times, lats, lons, mags, depths, types, gtypes, output_file, split):
+        """ Run an event or phase query, bisecting it until no response
+        is truncated by nevntmax when split is True. Returns the merged
+        output with each event once and the unfinished CommandStats of
+        the last command.
+
+        The error of a query that was not split is left in self.error as
+        for other commands. If the query was split and any part failed,
+        self.error is set to the first error and an Exception is raised,
+        since the merged output would be missing the failed parts.
+        """
+
+        queries = [(times, lats, lons)]
+        messages = []
+        errors = []
+        nparts = 0
+        self.truncated = False
+        while True:
+            times, lats, lons = queries.pop(0)
+            message, halves, stats = self._query_part(cmd, evids, times, lats, lons, mags, depths, types, gtypes, output_file, split)
+            nparts += 1
+            if self.error is not None:
+                errors.append(self.error)
+            if halves is None:
+                messages.append(message)
+            else:
+                # Query the halves next so that the events stay in order.
+                queries[0:0] = halves
+            if not queries:
+                break
+            self._finish_stats(stats)
+
+        if errors:
+            self.error = errors[0]
+            if nparts > 1:
+                self._finish_stats(stats)
+                raise Exception('STP error in {} of {} parts of the {} query: {}'.format(len(errors), nparts, cmd, errors[0]))
+        return utils.merge_event_messages(messages, cmd == 'phase'), stats
+
+            
+    def get_events(self, evids=None, times=None, lats=None, lons=None, mags=None, depths=None, types=None, gtypes=None, output_file=None, is_xml=False, as_table=False, lazy=False, split=True, sink=None, raw=False, compact=False):
         """ Download events from STP using the EVENT command.
+
+        If as_table is True, the events are returned as a NumPy structured
+        array instead of an ObsPy Catalog. If lazy is True, a LazyCatalog
+        is returned, which only creates each Event when it is accessed.
+        If split is True, queries that return nevntmax events are split
+        into smaller time, latitude or longitude ranges until none is
+        truncated, and the results are merged. If sink is a ParquetSink,
+        the event table is also written to it. If raw is True, the STP
+        output text is returned without being parsed, and ObsPy is not
+        imported. If compact is True, a tables.EventTable is returned.
         """
 
         if not self.connected:
             print('STP is not connected')
             return None
-        self._get_event_phase('event', evids, times, lats, lons, mags, depths, types, gtypes, output_file)
-        catalog = Catalog()
-        for line in self.message.splitlines():
-            if not line.startswith('#'):
-                catalog.append(utils.make_event(line))
-        self._end_command()
+        message, stats = self._query_events('event', evids, times, lats, lons, mags, depths, types, gtypes, output_file, split)
+        parse_start = time.perf_counter()
+        table = None
+        if sink is not None:
+            # Imported here to keep NumPy from being loaded by import pystp.
+            from . import tables
+            table = tables.make_event_table(message)
+            sink.write(table)
+        catalog = utils.make_event_result(message, False, as_table, lazy, raw, compact, table)
+        stats.parse_time = time.perf_counter() - parse_start
+        self._finish_stats(stats)
         return catalog
 
         
-    def get_phases(self, evids=None, times=None, lats=None, lons=None, mags=None, depths=None, types=None, gtypes=None, output_file=None, is_xml=False):
+    def get_phases(self, evids=None, times=None, lats=None, lons=None, mags=None, depths=None, types=None, gtypes=None, output_file=None, is_xml=False, as_table=False, lazy=False, split=True, sink=None, raw=False, compact=False):
         """ Download events and phase picks from STP using the PHASE command.
+
+        If as_table is True, a tuple of NumPy structured arrays of events
+        and picks is returned instead of an ObsPy Catalog. If lazy is True,
+        a LazyCatalog is returned, which only creates each Event and its
+        Picks when it is accessed. split, sink and raw work as in
+        get_events, with the pick table written to the sink as well.
+        If compact is True, a tuple of a tables.EventTable and a
+        tables.PickTable is returned.
         """
 
         if not self.connected:
             print('STP is not connected')
             return None
-        self._get_event_phase('phase', evids, times, lats, lons, mags, depths, types, gtypes, output_file)
-        evid_pattern = re.compile('^[1-9]+')
-        catalog = Catalog()
-        event = None
-        for line in self.message.splitlines():
-            line = line.strip()
-            if not line.startswith('#'):
-                #print(evid_pattern.match(line))
-                if evid_pattern.match(line) is not None:
-                    #print('Creating event')
-                    event = utils.make_event(line)
-                    catalog.append(event)
-                else:
-                    #print('Creating phase pick')
-                    pick = utils.make_pick(line.strip(), event.origins[0].time)
-                    if event is None:
-                        raise Exception('Error parsing phase output')
-                    event.picks.append(pick)
-        self._end_command()    
+        message, stats = self._query_events('phase', evids, times, lats, lons, mags, depths, types, gtypes, output_file, split)
+        parse_start = time.perf_counter()
+        table = None
+        if sink is not None:
+            # Imported here to keep NumPy from being loaded by import pystp.
+            from . import tables
+            table = tables.make_phase_tables(message)
+            sink.write(table)
+        catalog = utils.make_event_result(message, True, as_table, lazy, raw, compact, table)
+        stats.parse_time = time.perf_counter() - parse_start
+        self._finish_stats(stats)
         return catalog
 
 
+    def reconnect(self):
+        """ Close the connection, if any, and connect again, restoring
+        the gain correction and nevntmax settings of the session.
+        """
+
+        try:
+            self.disconnect()
+        except OSError:
+            pass
+        self.connect(show_motd=False)
+        if self.gaincorr is not None:
+            self.set_gaincorr(self.gaincorr)
+
+
     def disconnect(self):
         """ Disconnect from the STP server.
         """
 
+        self._close_output()
+        self._stats = None
         if self.fdr:
             self.fdr.close()
         if self.socket:
             self.socket.close()
         self.connected = False
+        self.data_format = None
 
 if __name__ == '__main__':
     stp = STPClient('athabasca.gps.caltech.edu', 9999)
@@ -0,0 +1,158 @@
+from __future__ import print_function
+
+import datetime
+import json
+import os
+import time
+
+
+def run_with_retries(client, func, label, max_retries=3, retry_delay=5.0, before_attempt=None):
+    """ Call func(client), reconnecting the STPClient and retrying up to
+    max_retries more times after connection failures, waiting retry_delay
+    seconds, doubled after each attempt. before_attempt is an optional
+    function called before each attempt, such as RateLimiter.wait.
+
+    Returns (result, error), where error is None if func returned, or else
+    the last connection error. Errors sent by the server are not retried
+    and are left in client.error.
+    """
+
+    error = None
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            delay = retry_delay * 2 ** (attempt - 1)
+            print('Retrying {} in {} s after error: {}'.format(label, delay, error))
+            time.sleep(delay)
+        if before_attempt is not None:
+            before_attempt()
+        try:
+            if not client.connected:
+                client.reconnect()
+            return func(client), None
+        except (OSError, ConnectionError) as e:
+            # socket.timeout is a subclass of OSError.
+            error = str(e) or e.__class__.__name__
+            client.connected = False
+    return None, error
+
+
+class BulkTrigJob:
+    """ A restartable download of triggered waveforms for many events.
+
+    The waveform files of each event are written to the client's output
+    directory and the outcome of each event is appended to a JSON-lines
+    journal. When the job is run again with the same journal, events that
+    were completed and whose files still exist are skipped, and failed or
+    partial events are downloaded again. Lost connections are reopened
+    automatically.
+    """
+
+    def __init__(self, client, evids, journal=None, net='%', sta='%', chan='%', loc='%', radius=None, data_format='sac', max_retries=3, retry_delay=5.0, timeout=300.0):
+        """ Set up a new BulkTrigJob for the events in evids using an
+        STPClient, which does not need to be connected yet.
+
+        journal is the path of the journal file, which defaults to
+        pystp_journal.jsonl in the client's output directory. Each event
+        is tried up to max_retries more times after a connection failure,
+        waiting retry_delay seconds, doubled after each attempt, before
+        reconnecting. timeout is the socket timeout in seconds.
+        """
+        self.client = client
+        self.evids = evids if isinstance(evids, list) else [evids]
+        if journal is None:
+            journal = os.path.join(client.base_output_dir, 'pystp_journal.jsonl')
+        self.journal = journal
+        self.net = net
+        self.sta = sta
+        self.chan = chan
+        self.loc = loc
+        self.radius = radius
+        self.data_format = data_format
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+
+
+    def read_journal(self):
+        """ Return the most recent journal record of each event,
+        keyed by the event ID as a string.
+        """
+
+        records = {}
+        if not os.path.isfile(self.journal):
+            return records
+        with open(self.journal) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line may be incomplete if the job was killed while writing it.
+                    continue
+                records[record['evid']] = record
+        return records
+
+
+    def completed(self):
+        """ Return the set of event IDs, as strings, that were completed
+        and whose files all still exist.
+        """
+
+        done = set()
+        for evid, record in self.read_journal().items():
+            if record['status'] == 'done' and all(os.path.isfile(f) for f in record['files']):
+                done.add(evid)
+        return done
+
+
+    def _write_record(self, evid, status, files=None, error=None):
+        """ Append the outcome of an event to the journal.
+        """
+
+        record = {'evid': str(evid),
+                  'status': status,
+                  'files': files or [],
+                  'error': error,
+                  'time': datetime.datetime.utcnow().isoformat()}
+        with open(self.journal, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def _download(self, evid):
+        """ Download one event, reconnecting and retrying after connection
+        failures. Returns True if the event was completed.
+        """
+
+        def request(client):
+            client.get_trig(evid, self.net, self.sta, self.chan, self.loc, self.radius, self.data_format, as_stream=False, keep_files=True)
+
+        _, error = run_with_retries(self.client, request, 'event {}'.format(evid), self.max_retries, self.retry_delay)
+        if error is not None:
+            self._write_record(evid, 'failed', error=error)
+            return False
+        if self.client.error is not None:
+            # The server rejected the request, so retrying now will not help.
+            self._write_record(evid, 'failed', self.client.last_files, self.client.error)
+            return False
+        self._write_record(evid, 'done', self.client.last_files)
+        return True
+
+
+    def run(self):
+        """ Download all events that are not already complete. Returns a
+        dictionary with the lists of completed, failed and skipped event IDs.
+        """
+
+        self.client.set_timeout(self.timeout)
+        done = self.completed()
+        result = {'completed': [], 'failed': [], 'skipped': []}
+        for evid in self.evids:
+            if str(evid) in done:
+                result['skipped'].append(evid)
+            elif self._download(evid):
+                result['completed'].append(evid)
+            else:
+                result['failed'].append(evid)
+        print('Completed {} events, {} failed, {} skipped'.format(len(result['completed']), len(result['failed']), len(result['skipped'])))
+        return result
@@ -0,0 +1,119 @@
+from array import array
+
+from obspy.core.event import Catalog
+
+from . import utils
+
+
+class LazyCatalog(Catalog):
+    """ An ObsPy Catalog that keeps the raw STP event or phase output
+    and only creates the Event and Pick objects for an event when it
+    is indexed or iterated. Each event is cached after it is created.
+
+    Accessing the events attribute directly creates all of the events,
+    after which the catalog behaves like a regular Catalog.
+    """
+
+    def __init__(self, events=None, **kwargs):
+        self._message = ''
+        self._with_picks = False
+        self._starts = array('q')
+        self._ends = array('q')
+        self._events = []
+        super(LazyCatalog, self).__init__(events, **kwargs)
+
+
+    @classmethod
+    def from_message(cls, message, with_picks=False):
+        """ Create a LazyCatalog from STP event output, or from
+        STP phase output if with_picks is True.
+        """
+
+        catalog = cls()
+        catalog._message = message
+        catalog._with_picks = with_picks
+        catalog._starts, catalog._ends = utils.event_offsets(message, with_picks)
+        catalog._events = [None] * len(catalog._starts)
+        return catalog
+
+
+    def _event_text(self, index):
+        return self._message[self._starts[index]:self._ends[index]]
+
+
+    def _get_event(self, index):
+        """ Return the event at index, creating it if necessary.
+        """
+
+        event = self._events[index]
+        if event is None:
+            lines = [line.strip() for line in self._event_text(index).splitlines()]
+            lines = [line for line in lines if line and not line.startswith('#')]
+            event = utils.make_event(lines[0])
+            for line in lines[1:]:
+                event.picks.append(utils.make_pick(line, event.origins[0].time))
+            self._events[index] = event
+        return event
+
+
+    @property
+    def events(self):
+        for i in range(len(self._events)):
+            self._get_event(i)
+        # All events exist now, so the raw output is no longer needed.
+        self._message = ''
+        self._starts = array('q')
+        self._ends = array('q')
+        return self._events
+
+
+    @events.setter
+    def events(self, events):
+        self._message = ''
+        self._starts = array('q')
+        self._ends = array('q')
+        self._events = list(events)
+
+
+    @property
+    def evids(self):
+        """ The event IDs of the catalog, read without creating the events.
+        """
+
+        evids = []
+        for i, event in enumerate(self._events):
+            if event is None:
+                evids.append(self._event_text(i).split(None, 1)[0])
+            else:
+                evids.append(event.resource_id.id)
+        return evids
+
+
+    def __len__(self):
+        return len(self._events)
+
+
+    def __getitem__(self, index):
+        if index == "extra":
+            return self.__dict__[index]
+        if isinstance(index, slice):
+            catalog = self.__class__()
+            catalog._message = self._message
+            catalog._with_picks = self._with_picks
+            catalog._events = self._events[index]
+            if len(self._starts) > 0:
+                catalog._starts = self._starts[index]
+                catalog._ends = self._ends[index]
+            return catalog
+        if index < 0:
+            index += len(self._events)
+        if index < 0 or index >= len(self._events):
+            raise IndexError('Catalog index out of range')
+        return self._get_event(index)
+
+
+    def __iter__(self):
+        for i in range(len(self._events)):
+            if i >= len(self._events):
+                break
+            yield self._get_event(i)
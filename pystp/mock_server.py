@@ -0,0 +1,357 @@
+from __future__ import print_function
+
+import datetime
+import fnmatch
+import functools
+import io
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+from .utils import STP_TIME_FORMAT
+
+# ObsPy format names of the data formats served by the mock server.
+MOCK_FORMATS = {'sac': 'SAC', 'mseed': 'MSEED'}
+
+
+def _like(pattern, value):
+    """ Match value against an STP pattern, which uses % and _
+    as wildcards.
+    """
+
+    return fnmatch.fnmatchcase(value, pattern.replace('%', '*').replace('_', '?'))
+
+
+@functools.lru_cache(maxsize=256)
+def make_payload(net, sta, chan, loc, starttime, npts, sampling_rate, data_format):
+    """ Create a synthetic waveform file with npts samples
+    in the given data format.
+    """
+
+    from obspy.core import Trace, UTCDateTime
+
+    header = {'network': net, 'station': sta, 'channel': chan,
+              'location': '' if loc == '--' else loc,
+              'sampling_rate': sampling_rate,
+              'starttime': UTCDateTime(starttime)}
+    data = (np.sin(np.arange(npts) / 10.0) * 1000).astype('int32')
+    trace = Trace(data, header=header)
+    buf = io.BytesIO()
+    trace.write(buf, format=MOCK_FORMATS[data_format])
+    return buf.getvalue()
+
+
+class MockSTPHandler(socketserver.StreamRequestHandler):
+    """ Handles one client session of the mock STP server.
+    """
+
+    # Buffer responses and flush them at the end of each reply.
+    wbufsize = 65536
+
+    def setup(self):
+        super(MockSTPHandler, self).setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.config = self.server
+        self.data_format = 'sac'
+        self.nevntmax = self.config.nevntmax
+
+    def _write(self, data):
+        """ Write data to the client, limited to the configured bandwidth.
+        """
+
+        bandwidth = self.config.bandwidth
+        if not bandwidth:
+            self.wfile.write(data)
+            return
+        chunk_size = max(1, min(len(data), int(bandwidth / 100)))
+        for i in range(0, len(data), chunk_size):
+            chunk = data[i:i + chunk_size]
+            self.wfile.write(chunk)
+            self.wfile.flush()
+            time.sleep(len(chunk) / bandwidth)
+
+    def _message(self, text):
+        self._write(b'MESS\n' + text.encode('ascii') + b'ENDmess\n')
+
+    def _over(self):
+        self._write(b'OVER\n')
+        self.wfile.flush()
+
+    def _error(self, text):
+        self._write('ERR {}\n'.format(text).encode('ascii'))
+        self._over()
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line.startswith(b'STP'):
+            return
+        self._write(b'CONNECTED\n')
+        self.wfile.flush()
+        sample = self.rfile.read(4)
+        if len(sample) != 4 or struct.unpack('I', sample)[0] != 2:
+            return
+        self._message(self.config.motd)
+        self._over()
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            words = line.decode('ascii').split()
+            if not words:
+                continue
+            if self.config.latency:
+                time.sleep(self.config.latency)
+            self.server.count_command(words[0])
+            handler = getattr(self, '_cmd_' + words[0].lower(), None)
+            if words[0].lower() in ('sac', 'mseed', 'seed', 'ascii', 'v0', 'v1'):
+                handler = self._cmd_format
+            if handler is None:
+                self._error('Unknown command {}'.format(words[0]))
+            else:
+                handler(words)
+
+    def _cmd_format(self, words):
+        if words[0].lower() not in MOCK_FORMATS:
+            self._error('Format {} is not supported by the mock server'.format(words[0]))
+            return
+        self.data_format = words[0].lower()
+        self._over()
+
+    def _cmd_set(self, words):
+        if len(words) == 3 and words[1] == 'nevntmax':
+            self.nevntmax = int(words[2])
+        self._over()
+
+    def _cmd_gain(self, words):
+        self._message('Gain correction is {}\n'.format(words[1] if len(words) > 1 else 'on'))
+        self._over()
+
+    def _select_events(self, words):
+        """ Return the events matching the options of an event or phase command.
+        """
+
+        options = _parse_options(words[1:])
+        events = self.config.events
+        if '-e' in options:
+            evids = set(int(e) for e in options['-e'])
+            return [ev for ev in events if ev[0] in evids]
+        if '-t0' in options:
+            start = datetime.datetime.strptime(options['-t0'][0], STP_TIME_FORMAT)
+            end = datetime.datetime.strptime(options['-t0'][1], STP_TIME_FORMAT)
+            events = [ev for ev in events if start <= ev[1] <= end]
+        if '-mag' in options:
+            low, high = [float(m) for m in options['-mag'][:2]]
+            events = [ev for ev in events if low <= ev[5] <= high]
+        if '-lat' in options:
+            low, high = [float(m) for m in options['-lat'][:2]]
+            events = [ev for ev in events if low <= ev[2] <= high]
+        if '-lon' in options:
+            low, high = [float(m) for m in options['-lon'][:2]]
+            events = [ev for ev in events if low <= ev[3] <= high]
+        return events[:self.nevntmax]
+
+    def _cmd_event(self, words):
+        text = '#  EVID ET GT  TIME                     LAT        LON       DEPTH  MAG MT Q\n'
+        for ev in self._select_events(words):
+            text += _event_line(ev)
+        self._message(text)
+        self._over()
+
+    def _cmd_phase(self, words):
+        text = ''
+        for ev in self._select_events(words):
+            text += _event_line(ev)
+            for i in range(self.config.picks_per_event):
+                net, sta, chan, loc = self.config.channels[i % len(self.config.channels)]
+                phase = 'P' if i % 2 == 0 else 'S'
+                text += '{:<5} {:>5} {} {}   35.8157  -117.5975   775.0 {} c. i  1.0 {:7.2f} {:7.3f}\n'.format(
+                    net, sta, chan, loc, phase, 5.0 + i, 1.0 + i * 0.5)
+        self._message(text)
+        self._over()
+
+    def _available(self, evid):
+        """ Return whether the mock server has waveforms for an event.
+        """
+
+        return (evid % 100) < self.config.data_fraction * 100
+
+    def _cmd_eavail(self, words):
+        options = _parse_options(words[1:-1])
+        evid = int(words[-1])
+        channels = []
+        if self._available(evid):
+            channels = [c for c in self.config.channels if _match_channel(c, options)]
+        text = ''
+        for channel in channels:
+            if '-l' in options:
+                text += '{} {} {} {}\n'.format(*channel)
+            else:
+                text += '{}\n'.format('.'.join(channel))
+        text += '# {} seismograms\n'.format(len(channels))
+        self._message(text)
+        self._over()
+
+    def _send_files(self, channels, starttime, npts, prefix):
+        """ Send a waveform file for each of the channels.
+        """
+
+        block_size = self.config.block_size
+        for net, sta, chan, loc in channels:
+            data = make_payload(net, sta, chan, loc, starttime, npts, self.config.sampling_rate, self.data_format)
+            self.server.count_bytes(len(data))
+            name = '{}.{}.{}.{}.{}.{}'.format(prefix, net, sta, chan, loc, self.data_format)
+            self._write('FILE {}\n'.format(name).encode('ascii'))
+            for i in range(0, len(data), block_size):
+                block = data[i:i + block_size]
+                self._write('DATA {}\n'.format(len(block)).encode('ascii'))
+                self._write(block)
+            self._write(b'ENDdata\n')
+
+    def _cmd_trig(self, words):
+        options = _parse_options(words[1:-1])
+        evid = int(words[-1])
+        events = [ev for ev in self.config.events if ev[0] == evid]
+        if not events:
+            self._error('Event {} not found'.format(evid))
+            return
+        self._write('DIR {}\n'.format(evid).encode('ascii'))
+        if self._available(evid):
+            channels = [c for c in self.config.channels if _match_channel(c, options)]
+            starttime = events[0][1] - datetime.timedelta(seconds=self.config.pre_event)
+            self._send_files(channels, starttime, self.config.npts, evid)
+        self._over()
+
+    def _cmd_wind(self, words):
+        if len(words) < 7:
+            self._error('Usage: wind net sta chan loc start end')
+            return
+        options = {'-net': [words[1]], '-sta': [words[2]], '-chan': [words[3]], '-loc': [words[4]]}
+        start = datetime.datetime.strptime(words[5], STP_TIME_FORMAT)
+        end = datetime.datetime.strptime(words[6], STP_TIME_FORMAT)
+        channels = [c for c in self.config.channels if _match_channel(c, options)]
+        npts = int((end - start).total_seconds() * self.config.sampling_rate) + 1
+        self._send_files(channels, start, npts, start.strftime('%Y%m%d%H%M%S'))
+        self._over()
+
+
+def _parse_options(words):
+    """ Split STP command options into a dictionary of option
+    names and their values.
+    """
+
+    options = {}
+    name = None
+    for word in words:
+        if word.startswith('-') and not word[1:].replace('.', '').isdigit():
+            name = word
+            options[name] = []
+        elif name is not None:
+            options[name].append(word)
+    return options
+
+
+def _match_channel(channel, options):
+    """ Return whether a (net, sta, chan, loc) channel matches the
+    -net, -sta, -chan and -loc options of a command.
+    """
+
+    for value, option in zip(channel, ['-net', '-sta', '-chan', '-loc']):
+        if option in options and options[option] and not _like(options[option][0], value):
+            return False
+    return True
+
+
+def _event_line(ev):
+    evid, origin_time, lat, lon, depth, mag = ev
+    return '{} eq l {} {:8.4f} {:9.4f} {:6.2f} {:4.2f} l 1.0\n'.format(
+        evid, origin_time.strftime(STP_TIME_FORMAT)[:-3], lat, lon, depth, mag)
+
+
+class MockSTPServer(socketserver.ThreadingTCPServer):
+    """ A stand-in STP server that serves a synthetic catalog and
+    synthetic SAC or miniSEED waveforms, for testing and benchmarking
+    without the real server.
+
+    nevents events are spaced event_interval seconds apart starting at
+    start_time. Each trig or wind request returns one file of npts
+    samples for each of the channels, a list of (net, sta, chan, loc).
+    latency is the delay in seconds before each response and bandwidth,
+    if set, limits the rate at which data are sent in bytes per second.
+    Only events whose evid modulo 100 is below data_fraction * 100
+    have waveforms.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, nevents=1000, start_time=datetime.datetime(2020, 1, 1),
+                 event_interval=60.0, first_evid=10000000, picks_per_event=10, channels=None, npts=6000,
+                 sampling_rate=100.0, pre_event=10.0, latency=0.0, bandwidth=None, block_size=16384,
+                 nevntmax=100, data_fraction=1.0, motd='Welcome to the mock STP server\n'):
+        """ Set up a new MockSTPServer. Port 0 picks a free port.
+        """
+        if channels is None:
+            channels = [('CI', 'S{:03d}'.format(i), 'HHZ', '--') for i in range(10)]
+        self.channels = channels
+        self.npts = npts
+        self.sampling_rate = sampling_rate
+        self.pre_event = pre_event
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.block_size = block_size
+        self.nevntmax = nevntmax
+        self.picks_per_event = picks_per_event
+        self.data_fraction = data_fraction
+        self.motd = motd
+        self.events = []
+        for i in range(nevents):
+            origin_time = start_time + datetime.timedelta(seconds=i * event_interval)
+            self.events.append((first_evid + i, origin_time, 32.0 + (i % 500) * 0.01,
+                                -118.0 + (i % 300) * 0.01, 5.0 + (i % 20) * 0.5, 0.5 + (i % 45) * 0.1))
+        self.command_counts = {}
+        self.bytes_sent = 0
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), MockSTPHandler)
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count_command(self, command):
+        with self._stats_lock:
+            self.command_counts[command] = self.command_counts.get(command, 0) + 1
+
+    def count_bytes(self, nbytes):
+        with self._stats_lock:
+            self.bytes_sent += nbytes
+
+    def start(self):
+        """ Serve requests in a background thread.
+        """
+
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop the background thread and close the server.
+        """
+
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
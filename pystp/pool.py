@@ -0,0 +1,327 @@
+from __future__ import print_function
+
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from . import utils
+from .client import STPClient
+from .stats import ClientStats
+
+
+class STPClientPool:
+    """ A pool of connected STPClient sessions that can download
+    waveforms for many events concurrently.
+    """
+
+    def __init__(self, host='stp.gps.caltech.edu', port=9999, size=4, output_dir='.', verbose=False, cache=None, decode_executor=None, availability=None):
+        """ Set up a new STPClientPool object with size sessions.
+        The sessions share the optional WaveformCache cache,
+        decode_executor and AvailabilityIndex availability.
+        """
+        self.host = host
+        self.port = port
+        self.size = size
+        self.output_dir = output_dir
+        self.verbose = verbose
+        self.cache = cache
+        self.decode_executor = decode_executor
+        self.availability = availability
+        self.stats = ClientStats()   # Totals shared by all of the sessions
+        self.hooks = []
+        self.clients = []
+        self.timeout = None   # Socket timeout in seconds of each session
+        self.truncated = False   # True if the last event or phase query may be missing events
+        self._idle = queue.Queue()
+        self.connected = False
+
+
+    def connect(self, show_motd=True):
+        """ Open all of the sessions in the pool. The message of the day
+        is only shown once.
+        """
+
+        if self.connected:
+            print('Already connected')
+            return
+
+        for i in range(self.size):
+            client = STPClient(self.host, self.port, self.output_dir, self.verbose, self.cache, self.decode_executor, self.availability)
+            client.stats = self.stats
+            client.hooks = self.hooks
+            client.set_timeout(self.timeout)
+            client.connect(show_motd and i == 0)
+            self.clients.append(client)
+            self._idle.put(client)
+        self.connected = True
+
+
+    def add_hook(self, hook):
+        """ Register a function to be called with the CommandStats of each
+        command completed by any session. Hooks may be called from
+        several threads at once.
+        """
+        self.hooks.append(hook)
+
+
+    def remove_hook(self, hook):
+        """ Unregister a function added with add_hook.
+        """
+        self.hooks.remove(hook)
+
+
+    def set_nevntmax(self, value=100):
+        """ Set the maximum number of events returned by the event
+        command on all of the sessions.
+        """
+        for client in self.clients:
+            client.set_nevntmax(value)
+
+
+    def set_gaincorr(self, value='on'):
+        """ Set the gain correction to on or off on all of the sessions.
+        """
+        for client in self.clients:
+            client.set_gaincorr(value)
+
+
+    def set_timeout(self, timeout):
+        """ Set the socket timeout in seconds of all of the sessions,
+        including those opened later, or None to wait indefinitely.
+        """
+        self.timeout = timeout
+        for client in self.clients:
+            client.set_timeout(timeout)
+
+
+    def disconnect(self):
+        """ Close all of the sessions in the pool.
+        """
+
+        for client in self.clients:
+            client.disconnect()
+        self.clients = []
+        self._idle = queue.Queue()
+        self.connected = False
+
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+
+
+    def _run(self, func, *args, **kwargs):
+        """ Call func with an idle client as its first argument, waiting
+        for a session to become available. A session that lost its
+        connection, or whose last command failed with a socket error such
+        as a timeout, is reconnected first.
+        """
+
+        client = self._idle.get()
+        try:
+            if not client.connected:
+                try:
+                    client.reconnect()
+                except Exception as e:
+                    client.connected = False
+                    raise ConnectionError('Could not reconnect STP session: {}'.format(e))
+            return func(client, *args, **kwargs)
+        except (OSError, ConnectionError):
+            # The rest of the response may still arrive, so the session cannot be reused.
+            client.connected = False
+            raise
+        finally:
+            self._idle.put(client)
+
+
+    def get_trig(self, evids, net='%', sta='%', chan='%', loc='%', radius=None, data_format='sac', as_stream=True, keep_files=False, max_workers=None, use_availability=False, sink=None):
+        """ Download triggered waveforms for a list of events, spreading the
+        events across the sessions in the pool. At most max_workers events
+        are requested at once, which defaults to the size of the pool.
+        Returns a dictionary with event IDs as keys and Streams as values.
+        See STPClient.iter_trig for use_availability. If sink is an
+        HDF5Sink, the Streams are written to it in the order of evids
+        instead of being returned, and the values are None.
+        """
+
+        if not self.connected:
+            print('STP is not connected')
+            return None
+
+        if not isinstance(evids, list):
+            evids = [evids]
+        if max_workers is None or max_workers > len(self.clients):
+            max_workers = len(self.clients)
+
+        def request_event(client, evid):
+            return client.get_trig(evid, net, sta, chan, loc, radius, data_format, as_stream or sink is not None, keep_files, use_availability=use_availability)[evid]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self._run, request_event, evid) for evid in evids]
+            result = {}
+            for evid, future in zip(evids, futures):
+                if sink is not None:
+                    # The sink is only written from this thread.
+                    sink.write(future.result(), event_id=evid)
+                    result[evid] = None
+                else:
+                    result[evid] = future.result()
+        return result
+
+
+    def get_continuous(self, start_time, end_time, net='%', sta='%', chan='%', loc='%', data_format='sac', as_stream=True, keep_files=False, chunk_length=3600, max_workers=None, fill_value=None, sink=None):
+        """ Download continuous waveforms for a long time range, requesting
+        chunks of chunk_length seconds concurrently across the sessions in
+        the pool. See STPClient.get_continuous.
+        """
+
+        if not self.connected:
+            print('STP is not connected')
+            return None
+        if not start_time or not end_time:
+            print ('Time range is required')
+            return None
+        if net=='%' and sta=='%' and chan=='%':
+            print ('At least one of net/sta/chan is required.' )
+            return None
+
+        if max_workers is None or max_workers > len(self.clients):
+            max_workers = len(self.clients)
+        chunks = utils.split_time_range(start_time, end_time, chunk_length)
+
+        def request_chunk(client, chunk_start, chunk_end):
+            return client.get_window(chunk_start, chunk_end, net, sta, chan, loc, data_format, as_stream or sink is not None, keep_files)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self._run, request_chunk, chunk_start, chunk_end) for chunk_start, chunk_end in chunks]
+            if sink is not None:
+                for future in futures:
+                    sink.write(future.result())
+                return None
+            if not as_stream:
+                for future in futures:
+                    future.result()
+                return None
+            return utils.merge_streams([future.result() for future in futures], fill_value)
+
+
+    def get_windows(self, requests, data_format='sac', merge_components=False, max_gap=0.0, max_workers=None):
+        """ Download continuous waveforms for many (net, sta, chan, loc,
+        start, end) requests, combining them as in STPClient.get_windows
+        and running the WIND commands concurrently across the sessions.
+        Returns a dictionary with the request tuples as keys and the
+        Stream of each request as values.
+        """
+
+        if not self.connected:
+            print('STP is not connected')
+            return None
+
+        if max_workers is None or max_workers > len(self.clients):
+            max_workers = len(self.clients)
+        windows = utils.coalesce_windows(requests, merge_components, max_gap)
+
+        def request_window(client, net, sta, chan, loc, start, end):
+            cmd = utils.make_wind_command(start, end, net, sta, chan, loc)
+            st = client._send_data_command(cmd, data_format)
+            client._end_command()
+            return st
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self._run, request_window, *window[:6]) for window in windows]
+            result = {}
+            for window, future in zip(windows, futures):
+                st = future.result()
+                for request in window[6]:
+                    result[request] = utils.select_window(st, *request)
+        return result
+
+
+    def _query_events(self, cmd, evids, times, lats, lons, mags, depths, types, gtypes, max_workers):
+        """ Run an event or phase query split into at least max_workers
+        parts across the sessions in the pool. Parts that are truncated
+        by nevntmax are bisected and queried again. Returns the merged
+        output with each event once. Sets self.truncated if any part may
+        be missing events.
+        """
+
+        self.truncated = False
+        queries = [(times, lats, lons)]
+        if evids is None:
+            while len(queries) < max_workers:
+                halves = [utils.bisect_query(*query) for query in queries]
+                if any(h is None for h in halves):
+                    break
+                queries = [query for pair in halves for query in pair]
+
+        def request_part(client, times, lats, lons):
+            client.truncated = False
+            message, halves, stats = client._query_part(cmd, evids, times, lats, lons, mags, depths, types, gtypes, None, True)
+            client._finish_stats(stats)
+            if client.error is not None:
+                raise Exception('STP error: {}'.format(client.error))
+            if client.truncated:
+                self.truncated = True
+            return message, halves
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self._run, request_part, *query) for query in queries]
+            messages = []
+            i = 0
+            while i < len(futures):
+                message, halves = futures[i].result()
+                if halves is None:
+                    messages.append(message)
+                    i += 1
+                else:
+                    futures[i:i + 1] = [executor.submit(self._run, request_part, *half) for half in halves]
+        return utils.merge_event_messages(messages, cmd == 'phase')
+
+
+    def get_events(self, evids=None, times=None, lats=None, lons=None, mags=None, depths=None, types=None, gtypes=None, as_table=False, lazy=False, max_workers=None, sink=None, raw=False, compact=False):
+        """ Download events using the EVENT command, splitting the time
+        range, or the latitude and longitude ranges, across the sessions
+        in the pool. Events that appear in more than one part are only
+        returned once. See STPClient.get_events, including for sink, raw
+        and compact.
+        """
+
+        if not self.connected:
+            print('STP is not connected')
+            return None
+
+        if max_workers is None or max_workers > len(self.clients):
+            max_workers = len(self.clients)
+        message = self._query_events('event', evids, times, lats, lons, mags, depths, types, gtypes, max_workers)
+        table = None
+        if sink is not None:
+            # Imported here to keep NumPy from being loaded by import pystp.
+            from . import tables
+            table = tables.make_event_table(message)
+            sink.write(table)
+        return utils.make_event_result(message, False, as_table, lazy, raw, compact, table)
+
+
+    def get_phases(self, evids=None, times=None, lats=None, lons=None, mags=None, depths=None, types=None, gtypes=None, as_table=False, lazy=False, max_workers=None, sink=None, raw=False, compact=False):
+        """ Download events and phase picks using the PHASE command,
+        splitting the query across the sessions in the pool as in
+        get_events. See STPClient.get_phases.
+        """
+
+        if not self.connected:
+            print('STP is not connected')
+            return None
+
+        if max_workers is None or max_workers > len(self.clients):
+            max_workers = len(self.clients)
+        message = self._query_events('phase', evids, times, lats, lons, mags, depths, types, gtypes, max_workers)
+        table = None
+        if sink is not None:
+            # Imported here to keep NumPy from being loaded by import pystp.
+            from . import tables
+            table = tables.make_phase_tables(message)
+            sink.write(table)
+        return utils.make_event_result(message, True, as_table, lazy, raw, compact, table)
@@ -0,0 +1,153 @@
+import collections
+import threading
+
+from . import utils
+
+
+def event_ids(events):
+    """ Return the event IDs of a Catalog or LazyCatalog, an EventTable
+    or structured event array, the STP output text of an event query,
+    a single event ID or a list of event IDs.
+    """
+
+    if isinstance(events, str):
+        if events.strip().isdigit():
+            return [events.strip()]
+        starts, ends = utils.event_offsets(events)
+        return [events[start:end].split(None, 1)[0] for start, end in zip(starts, ends)]
+    if hasattr(events, 'evids'):
+        # LazyCatalog
+        return list(events.evids)
+    try:
+        # EventTable or structured array
+        return [str(evid) for evid in events['evid'].tolist()]
+    except (TypeError, KeyError, IndexError, ValueError):
+        pass
+    return [event.resource_id.id if hasattr(event, 'resource_id') else event for event in events]
+
+
+def stream_nbytes(st):
+    """ Return the number of bytes of waveform data in a Stream, or 0
+    for results without data, such as the file lists returned with
+    as_stream=False.
+    """
+
+    if st is None or isinstance(st, list):
+        return 0
+    return sum(tr.data.nbytes for tr in st)
+
+
+class TrigPrefetcher:
+    """ Iterates over the triggered waveforms of the events of a catalog,
+    yielding (evid, Stream) like STPClient.iter_trig, while a background
+    thread downloads the waveforms of the next events.
+
+    While the caller processes event k, the waveforms of events k+1 to
+    k+read_ahead are downloaded, so that processing overlaps with the
+    network I/O. If max_bytes is set, no further event is requested while
+    the waveforms waiting to be processed hold that many bytes of data,
+    although one event is always fetched even if it is larger.
+
+    The client is used by the background thread until the iteration
+    ends or close is called, and must not be used by the caller until then.
+    """
+
+    def __init__(self, client, events, net='%', sta='%', chan='%', loc='%', radius=None, data_format='sac',
+                 as_stream=True, keep_files=False, read_ahead=4, max_bytes=None, pipeline=1, use_availability=False):
+        """ Set up a new TrigPrefetcher for events, which may be anything
+        accepted by event_ids. The other options are those of iter_trig.
+        """
+        self.client = client
+        self.evids = event_ids(events)
+        self.trig_args = (net, sta, chan, loc, radius, data_format, as_stream, keep_files, pipeline, use_availability)
+        self.read_ahead = max(1, read_ahead)
+        self.max_bytes = max_bytes
+        self.nbytes = 0                        # Bytes of data in the buffered waveforms
+        self._buffer = collections.deque()     # (evid, Stream, nbytes) downloaded but not yet yielded
+        self._done = False
+        self._error = None
+        self._stop = False
+        self._thread = None
+        self._condition = threading.Condition()
+
+
+    def _full(self):
+        if len(self._buffer) >= self.read_ahead:
+            return True
+        return self.max_bytes is not None and len(self._buffer) > 0 and self.nbytes >= self.max_bytes
+
+
+    def _download(self):
+        results = self.client.iter_trig(self.evids, *self.trig_args)
+        try:
+            for evid, st in results:
+                nbytes = stream_nbytes(st)
+                with self._condition:
+                    self._buffer.append((evid, st, nbytes))
+                    self.nbytes += nbytes
+                    self._condition.notify_all()
+                    # Wait for room before the next event is requested.
+                    while self._full() and not self._stop:
+                        self._condition.wait()
+                    if self._stop:
+                        break
+                st = None
+        except Exception as e:
+            self._error = e
+        finally:
+            results.close()
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+
+
+    def start(self):
+        """ Start downloading in the background, if not started already.
+        """
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._download, daemon=True)
+            self._thread.start()
+
+
+    def __iter__(self):
+        self.start()
+        try:
+            while True:
+                with self._condition:
+                    while not self._buffer and not self._done:
+                        self._condition.wait()
+                    if not self._buffer:
+                        break
+                    evid, st, nbytes = self._buffer.popleft()
+                    self.nbytes -= nbytes
+                    self._condition.notify_all()
+                yield evid, st
+                st = None
+            if self._error is not None:
+                raise self._error
+        finally:
+            self.close()
+
+
+    def close(self):
+        """ Stop downloading, wait for the request in progress to finish
+        and drop the buffered waveforms.
+        """
+
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        with self._condition:
+            self._buffer.clear()
+            self.nbytes = 0
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
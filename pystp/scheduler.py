@@ -0,0 +1,153 @@
+from __future__ import print_function
+
+import queue
+import threading
+import time
+
+from .client import STPClient
+from .jobs import run_with_retries
+from .stats import ClientStats
+
+
+class RateLimiter:
+    """ Limits the rate of commands shared by several threads to
+    rate per second, allowing bursts of up to burst commands.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def wait(self):
+        """ Block until another command may be sent.
+        """
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class Scheduler:
+    """ Runs waveform download tasks across several STPClient sessions,
+    with an optional limit on the rate of commands, reconnection and
+    retries with exponential backoff after connection failures, and
+    periodic progress reports.
+
+    Each task is a (label, func) tuple, where func downloads something
+    using the STPClient it is called with, such as
+    lambda client: client.get_trig(evid, as_stream=False, keep_files=True).
+    """
+
+    def __init__(self, host='stp.gps.caltech.edu', port=9999, sessions=4, output_dir='.', rate=None,
+                 max_retries=3, retry_delay=5.0, timeout=300.0, progress_interval=10.0, verbose=False):
+        """ Set up a new Scheduler with sessions connections. rate is
+        the maximum number of commands per second over all sessions,
+        or None for no limit. Progress is printed every progress_interval
+        seconds, or never if it is None.
+        """
+        self.host = host
+        self.port = port
+        self.sessions = sessions
+        self.output_dir = output_dir
+        self.rate_limiter = RateLimiter(rate) if rate else None
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.progress_interval = progress_interval
+        self.verbose = verbose
+        self.stats = ClientStats()   # Totals shared by all of the sessions
+        self.completed = []
+        self.failed = []             # (label, error) of the tasks that failed
+        self._lock = threading.Lock()
+
+
+    def _run_task(self, client, label, func):
+        """ Run one task, reconnecting and retrying after connection
+        failures. Returns None if the task succeeded or else the error.
+        """
+
+        before_attempt = self.rate_limiter.wait if self.rate_limiter is not None else None
+        _, error = run_with_retries(client, func, label, self.max_retries, self.retry_delay, before_attempt)
+        if error is not None:
+            return error
+        # Errors sent by the server are not retried.
+        return client.error
+
+
+    def _worker(self, tasks):
+        client = STPClient(self.host, self.port, self.output_dir, self.verbose)
+        client.stats = self.stats
+        client.set_timeout(self.timeout)
+        try:
+            while True:
+                try:
+                    label, func = tasks.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    error = self._run_task(client, label, func)
+                except Exception as e:
+                    # Other errors, such as a rejected handshake, only fail this task.
+                    error = str(e) or e.__class__.__name__
+                    client.connected = False
+                with self._lock:
+                    if error is None:
+                        self.completed.append(label)
+                    else:
+                        self.failed.append((label, error))
+        finally:
+            try:
+                client.disconnect()
+            except OSError:
+                pass
+
+
+    def _progress(self, ntasks, start):
+        """ Return a line describing the progress of the tasks.
+        """
+
+        elapsed = time.perf_counter() - start
+        nbytes = sum(totals['bytes_received'] for totals in self.stats.summary().values())
+        with self._lock:
+            ndone = len(self.completed) + len(self.failed)
+            nfailed = len(self.failed)
+        return '{}/{} tasks done, {} failed, {:.1f} MB in {:.0f} s ({:.2f} MB/s, {:.1f} tasks/s)'.format(
+            ndone, ntasks, nfailed, nbytes / 1e6, elapsed, nbytes / 1e6 / elapsed if elapsed > 0 else 0.0,
+            ndone / elapsed if elapsed > 0 else 0.0)
+
+
+    def run(self, tasks):
+        """ Run a list of (label, func) tasks and return a dictionary with
+        the labels of the completed tasks, the (label, error) of the failed
+        tasks, the number of unfinished tasks, which is only nonzero if a
+        session stopped unexpectedly, and the command totals from
+        ClientStats.summary.
+        """
+
+        task_queue = queue.Queue()
+        for task in tasks:
+            task_queue.put(task)
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._worker, args=(task_queue,), daemon=True)
+                   for i in range(min(self.sessions, len(tasks)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(self.progress_interval)
+                if thread.is_alive() and self.progress_interval is not None:
+                    print(self._progress(len(tasks), start))
+        print(self._progress(len(tasks), start))
+        unfinished = len(tasks) - len(self.completed) - len(self.failed)
+        return {'completed': self.completed, 'failed': self.failed, 'unfinished': unfinished, 'stats': self.stats.summary()}
@@ -0,0 +1,152 @@
+import os
+
+import numpy as np
+
+# Version of the ASDF format written by HDF5Sink.
+ASDF_VERSION = '1.0.3'
+
+
+class HDF5Sink:
+    """ Writes waveforms into a single chunked and compressed HDF5 file
+    with the ASDF layout, instead of one file per trace.
+
+    Each trace is stored as a dataset named NET.STA.LOC.CHAN__START__END__TAG
+    in the group Waveforms/NET.STA, with its start time in nanoseconds and
+    its sampling rate as attributes, so that the file can be read with pyasdf.
+    Requires h5py.
+    """
+
+    def __init__(self, path, mode='a', tag='raw_recording', compression='gzip'):
+        """ Open or create the HDF5 file at path. Traces are stored
+        with the given tag and HDF5 compression filter.
+        """
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError('HDF5Sink requires h5py, which can be installed with pip install pystp[hdf5]')
+        self.path = path
+        self.tag = tag
+        self.compression = compression
+        self.ntraces = 0
+        self.file = h5py.File(path, mode)
+        if 'file_format' not in self.file.attrs:
+            self.file.attrs['file_format'] = np.bytes_('ASDF')
+            self.file.attrs['file_format_version'] = np.bytes_(ASDF_VERSION)
+        self.waveforms = self.file.require_group('Waveforms')
+
+
+    def write(self, stream, event_id=None):
+        """ Append the traces of an ObsPy Stream, optionally linked
+        to the event event_id. Traces with gaps are split at the gaps.
+        None, returned for failed requests, is ignored.
+        """
+
+        if stream is None:
+            return
+        for trace in stream.split():
+            stats = trace.stats
+            station = self.waveforms.require_group('{}.{}'.format(stats.network, stats.station))
+            name = '{}__{}__{}__{}'.format(trace.id, stats.starttime.strftime('%Y-%m-%dT%H:%M:%S'),
+                                           stats.endtime.strftime('%Y-%m-%dT%H:%M:%S'), self.tag)
+            if name in station:
+                del station[name]
+            dataset = station.create_dataset(name, data=trace.data, chunks=True, compression=self.compression)
+            dataset.attrs['starttime'] = np.int64(stats.starttime.ns)
+            dataset.attrs['sampling_rate'] = np.float64(stats.sampling_rate)
+            if event_id is not None:
+                dataset.attrs['event_ids'] = np.bytes_(str(event_id))
+            self.ntraces += 1
+
+
+    def close(self):
+        """ Close the HDF5 file.
+        """
+        self.file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ParquetSink:
+    """ Writes the event and pick tables of event and phase queries to
+    events.parquet and picks.parquet in a directory, appending a row
+    group for each query. Requires pyarrow.
+    """
+
+    def __init__(self, path, compression='snappy'):
+        """ Set up a new ParquetSink in the directory path. The files
+        are created, replacing any existing ones, when the first rows
+        are written.
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('ParquetSink requires pyarrow, which can be installed with pip install pystp[parquet]')
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self.compression = compression
+        self.writers = {}   # Open ParquetWriter of each file
+        os.makedirs(path, exist_ok=True)
+
+
+    def _write_table(self, name, array):
+        """ Append a structured array as a row group of name.parquet.
+        """
+
+        if len(array) == 0:
+            return
+        table = self._pa.table({field: array[field] for field in array.dtype.names})
+        writer = self.writers.get(name)
+        if writer is None:
+            writer = self._pq.ParquetWriter(os.path.join(self.path, name + '.parquet'), table.schema, compression=self.compression)
+            self.writers[name] = writer
+        writer.write_table(table)
+
+
+    def write_events(self, events):
+        """ Append an event table made by tables.make_event_table.
+        """
+        self._write_table('events', events)
+
+
+    def write_picks(self, picks):
+        """ Append a pick table made by tables.make_phase_tables.
+        """
+        self._write_table('picks', picks)
+
+
+    def write(self, result):
+        """ Append an event table, or the (events, picks) tuple of tables
+        returned for a phase query.
+        """
+
+        if isinstance(result, tuple):
+            events, picks = result
+            self.write_events(events)
+            self.write_picks(picks)
+        else:
+            self.write_events(result)
+
+
+    def close(self):
+        """ Finish writing the Parquet files.
+        """
+
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
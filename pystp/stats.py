@@ -0,0 +1,87 @@
+import threading
+import time
+
+
+class CommandStats:
+    """ Measurements of a single STP command.
+
+    Times are in seconds. time_to_first_byte and transfer_time are
+    measured from when the command was sent, so for pipelined commands
+    they include the time spent waiting for earlier responses.
+    """
+
+    def __init__(self, command):
+        self.command = command          # Name of the STP command, such as trig or event
+        self.start = time.time()        # Time the command was started, as a Unix timestamp
+        self.bytes_received = 0
+        self.nfiles = 0                 # Number of FILE blocks
+        self.ndata = 0                  # Number of DATA blocks
+        self.time_to_first_byte = None
+        self.transfer_time = 0.0
+        self.decode_time = 0.0
+        self.parse_time = 0.0
+        self.total_time = 0.0
+        self.cached = False             # True if the results came from the WaveformCache
+        self.error = None               # Error message sent by the server, if any
+        self._t0 = time.perf_counter()
+
+    def elapsed(self):
+        """ Return the time since the command was started.
+        """
+        return time.perf_counter() - self._t0
+
+    def as_dict(self):
+        """ Return the measurements as a dictionary.
+        """
+        return {name: value for name, value in vars(self).items() if not name.startswith('_')}
+
+    def __repr__(self):
+        return 'CommandStats({})'.format(', '.join('{}={!r}'.format(k, v) for k, v in self.as_dict().items()))
+
+
+class ClientStats:
+    """ Totals of the CommandStats recorded by a client, by command.
+    A ClientStats can be shared by the clients of a pool.
+    """
+
+    # Fields of CommandStats that are summed.
+    TOTALS = ['bytes_received', 'nfiles', 'ndata', 'transfer_time', 'decode_time', 'parse_time', 'total_time']
+
+    def __init__(self):
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, stats):
+        """ Add the measurements of one command to the totals.
+        """
+
+        with self._lock:
+            totals = self.totals.setdefault(stats.command, dict({name: 0 for name in self.TOTALS}, count=0, cached=0, errors=0))
+            totals['count'] += 1
+            totals['cached'] += int(stats.cached)
+            totals['errors'] += int(stats.error is not None)
+            for name in self.TOTALS:
+                totals[name] += getattr(stats, name)
+
+    def summary(self):
+        """ Return a dictionary of the totals for each command, including
+        the mean time per command and the transfer rate in bytes per second.
+        """
+
+        summary = {}
+        with self._lock:
+            totals_by_command = {command: dict(totals) for command, totals in self.totals.items()}
+        for command, totals in totals_by_command.items():
+            summary[command] = dict(totals)
+            summary[command]['mean_time'] = totals['total_time'] / totals['count']
+            if totals['transfer_time'] > 0:
+                summary[command]['bytes_per_s'] = totals['bytes_received'] / totals['transfer_time']
+            else:
+                summary[command]['bytes_per_s'] = 0.0
+        return summary
+
+    def reset(self):
+        """ Clear the totals.
+        """
+        with self._lock:
+            self.totals = {}
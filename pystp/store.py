@@ -0,0 +1,218 @@
+from __future__ import print_function
+
+import calendar
+import datetime
+import sqlite3
+import threading
+
+from . import utils
+
+def _to_epoch(t):
+    """ Convert a naive UTC datetime to seconds since 1970.
+    """
+
+    return calendar.timegm(t.timetuple()) + t.microsecond / 1e6
+
+
+class CatalogStore:
+    """ A local copy of the STP event and phase catalog in an SQLite
+    database, indexed by evid, origin time, location and magnitude.
+
+    sync downloads only the parts of a time range that have not been
+    downloaded before, and get_events and get_phases answer queries
+    from the local copy without contacting the server.
+    """
+
+    def __init__(self, path):
+        """ Open or create the CatalogStore database at path.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            # text is the STP event line and picks the STP pick lines of the event,
+            # which are NULL until the event has been synced with phases.
+            self.db.execute('CREATE TABLE IF NOT EXISTS events (evid INTEGER PRIMARY KEY, type TEXT, gtype TEXT, '
+                            'time REAL, lat REAL, lon REAL, depth REAL, mag REAL, magtype TEXT, text TEXT, picks TEXT)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS events_time ON events (time)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS events_lat_lon ON events (lat, lon)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS events_mag ON events (mag)')
+            # The range of origin times downloaded so far by the event and phase commands.
+            self.db.execute('CREATE TABLE IF NOT EXISTS synced (command TEXT PRIMARY KEY, start REAL, end REAL)')
+
+
+    def synced_range(self, phases=False):
+        """ Return the (start, end) datetimes of the range synced with
+        the event command, or the phase command if phases is True,
+        or None if nothing has been synced.
+        """
+
+        with self._lock:
+            row = self.db.execute('SELECT start, end FROM synced WHERE command = ?', ('phase' if phases else 'event',)).fetchone()
+        if row is None:
+            return None
+        return tuple(datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=t) for t in row)
+
+
+    def _fetch_window(self, client, start, end, phases, evids):
+        """ Download the events of one time window and store them,
+        adding their event IDs to the set evids.
+        """
+
+        if phases:
+            message = client.get_phases(times=[start, end], raw=True)
+        else:
+            message = client.get_events(times=[start, end], raw=True)
+        if message is None:
+            raise Exception('STP is not connected')
+        if client.error is not None:
+            raise Exception('STP error: {}'.format(client.error))
+
+        rows = []
+        for event_start, event_end in zip(*utils.event_offsets(message, phases)):
+            lines = message[event_start:event_end].split('\n')
+            fields = lines[0].split()
+            origin_time = datetime.datetime.strptime(fields[3], utils.STP_TIME_FORMAT)
+            picks = '\n'.join(lines[1:]) if phases else None
+            rows.append((int(fields[0]), fields[1], fields[2], _to_epoch(origin_time),
+                         float(fields[4]), float(fields[5]), float(fields[6]), float(fields[7]),
+                         fields[8], lines[0].strip(), picks))
+
+        # A truncated response does not show which events were removed.
+        complete = not getattr(client, 'truncated', False)
+        if not complete:
+            print('Warning: the response for {} to {} may be incomplete, stored events are not removed'.format(start, end))
+        with self._lock, self.db:
+            if complete:
+                # Remove events that the server no longer has in this window.
+                self.db.execute('CREATE TEMP TABLE IF NOT EXISTS window_evids (evid INTEGER PRIMARY KEY)')
+                self.db.execute('DELETE FROM window_evids')
+                self.db.executemany('INSERT OR IGNORE INTO window_evids VALUES (?)', [(row[0],) for row in rows])
+                self.db.execute('DELETE FROM events WHERE time >= ? AND time <= ? AND evid NOT IN (SELECT evid FROM window_evids)',
+                                (_to_epoch(start), _to_epoch(end)))
+            self.db.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (evid) DO UPDATE SET '
+                                'type = excluded.type, gtype = excluded.gtype, time = excluded.time, lat = excluded.lat, '
+                                'lon = excluded.lon, depth = excluded.depth, mag = excluded.mag, magtype = excluded.magtype, '
+                                'text = excluded.text, picks = COALESCE(excluded.picks, events.picks)', rows)
+        evids.update(row[0] for row in rows)
+
+
+    def sync(self, client, start_time, end_time=None, phases=False, window=86400.0, overlap=0.0):
+        """ Bring the store up to date for origin times from start_time
+        to end_time, which defaults to now, using a connected STPClient.
+
+        Only the parts of the range outside the previously synced range
+        are downloaded, plus the last overlap seconds of it to pick up
+        late or revised events. The range is downloaded in windows of
+        window seconds, which the client splits further if they reach
+        its nevntmax. If phases is True, the picks of the events are
+        downloaded and stored as well. Stored events missing from a
+        window are removed unless its response may be truncated.
+        Returns the number of distinct events downloaded.
+        """
+
+        start = utils.to_datetime(start_time)
+        end = utils.to_datetime(end_time) if end_time is not None else datetime.datetime.utcnow()
+        synced = self.synced_range(phases)
+
+        ranges = []
+        if synced is None:
+            ranges.append((start, end))
+        else:
+            synced_start, synced_end = synced
+            if start < synced_start:
+                ranges.append((start, synced_start))
+            if end > synced_end:
+                ranges.append((max(min(start, synced_end), synced_end - datetime.timedelta(seconds=overlap)), end))
+            start = min(start, synced_start)
+            end = max(end, synced_end)
+
+        evids = set()
+        step = datetime.timedelta(seconds=window)
+        for range_start, range_end in ranges:
+            window_start = range_start
+            while window_start < range_end:
+                window_end = min(window_start + step, range_end)
+                self._fetch_window(client, window_start, window_end, phases, evids)
+                window_start = window_end
+
+            # Record progress after each range so that an interrupted sync can continue.
+            with self._lock, self.db:
+                row = self.db.execute('SELECT start, end FROM synced WHERE command = ?', ('phase' if phases else 'event',)).fetchone()
+                new_start, new_end = _to_epoch(range_start), _to_epoch(range_end)
+                if row is not None:
+                    new_start, new_end = min(new_start, row[0]), max(new_end, row[1])
+                self.db.execute('INSERT OR REPLACE INTO synced VALUES (?, ?, ?)', ('phase' if phases else 'event', new_start, new_end))
+
+        if client.verbose:
+            print('Synced {} events from {} to {}'.format(len(evids), start, end))
+        return len(evids)
+
+
+    def _query(self, evids, times, lats, lons, mags, depths, types, gtypes, phases):
+        """ Return the STP output text of the stored events that match a query.
+        """
+
+        conditions = []
+        params = []
+        if evids is not None:
+            evids = [int(e) for e in evids]
+            conditions.append('evid IN ({})'.format(', '.join('?' * len(evids))))
+            params.extend(evids)
+        else:
+            for column, bounds in [('time', times), ('lat', lats), ('lon', lons), ('mag', mags), ('depth', depths)]:
+                if bounds is not None:
+                    if column == 'time':
+                        bounds = [_to_epoch(utils.to_datetime(t)) for t in bounds]
+                    conditions.append('{0} >= ? AND {0} <= ?'.format(column))
+                    params.extend([float(bounds[0]), float(bounds[1])])
+            for column, values in [('type', types), ('gtype', gtypes)]:
+                if values is not None:
+                    conditions.append('{} IN ({})'.format(column, ', '.join('?' * len(values))))
+                    params.extend(values)
+        if phases:
+            conditions.append('picks IS NOT NULL')
+
+        sql = 'SELECT text, picks FROM events'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY time'
+        with self._lock:
+            rows = self.db.execute(sql, params).fetchall()
+        lines = []
+        for text, picks in rows:
+            lines.append(text)
+            if phases and picks:
+                lines.append(picks)
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+    def get_events(self, evids=None, times=None, lats=None, lons=None, mags=None, depths=None, types=None, gtypes=None, as_table=False, lazy=False, raw=False, compact=False):
+        """ Return the stored events that match a query, with the same
+        options and return types as STPClient.get_events.
+        """
+
+        message = self._query(evids, times, lats, lons, mags, depths, types, gtypes, False)
+        return utils.make_event_result(message, False, as_table, lazy, raw, compact)
+
+
+    def get_phases(self, evids=None, times=None, lats=None, lons=None, mags=None, depths=None, types=None, gtypes=None, as_table=False, lazy=False, raw=False, compact=False):
+        """ Return the stored events and picks that match a query, with
+        the same options and return types as STPClient.get_phases. Only
+        events that were synced with phases=True are returned.
+        """
+
+        message = self._query(evids, times, lats, lons, mags, depths, types, gtypes, True)
+        return utils.make_event_result(message, True, as_table, lazy, raw, compact)
+
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+
+    def close(self):
+        """ Close the database.
+        """
+        with self._lock:
+            self.db.close()
@@ -0,0 +1,476 @@
+import fnmatch
+
+import numpy as np
+
+from . import utils
+from .utils import EVID_PATTERN
+
+EVENT_DTYPE = np.dtype([('evid', 'i8'),
+                        ('type', 'U2'),
+                        ('gtype', 'U1'),
+                        ('time', 'datetime64[us]'),
+                        ('lat', 'f8'),
+                        ('lon', 'f8'),
+                        ('depth', 'f8'),
+                        ('mag', 'f8'),
+                        ('magtype', 'U2')])
+
+PICK_DTYPE = np.dtype([('evid', 'i8'),
+                       ('net', 'U8'),
+                       ('sta', 'U8'),
+                       ('chan', 'U8'),
+                       ('loc', 'U8'),
+                       ('lat', 'f8'),
+                       ('lon', 'f8'),
+                       ('elev', 'f8'),
+                       ('phase', 'U8'),
+                       ('first_motion', 'U2'),
+                       ('onset', 'U1'),
+                       ('quality', 'f8'),
+                       ('distance', 'f8'),
+                       ('offset', 'f8'),
+                       ('time', 'datetime64[us]')])
+
+# Number of leading fields used from each line of STP output.
+EVENT_NFIELDS = 9
+PICK_NFIELDS = 13
+
+
+def _parse_times(times):
+    """ Converts STP time strings to datetime64 values.
+    """
+
+    times = np.asarray(times, dtype='U32')
+    times = np.char.replace(np.char.replace(times, '/', '-'), ',', 'T')
+    return times.astype('datetime64[us]')
+
+
+def _fill_events(rows):
+    """ Creates an event array from lists of split STP event lines.
+    """
+
+    events = np.empty(len(rows), dtype=EVENT_DTYPE)
+    if len(rows) == 0:
+        return events
+    columns = list(zip(*[row[:EVENT_NFIELDS] for row in rows]))
+    if len(columns) != EVENT_NFIELDS:
+        raise Exception('Invalid STP event output')
+    events['evid'] = np.array(columns[0], dtype='i8')
+    events['type'] = columns[1]
+    events['gtype'] = columns[2]
+    events['time'] = _parse_times(columns[3])
+    for i, name in enumerate(['lat', 'lon', 'depth', 'mag'], 4):
+        events[name] = np.array(columns[i], dtype='f8')
+    events['magtype'] = columns[8]
+    return events
+
+
+def make_event_table(message):
+    """ Creates a structured array with one row per event
+    from STP event output. The array can be converted to
+    a pandas DataFrame with pandas.DataFrame(events).
+    """
+
+    rows = [line.split() for line in message.splitlines() if line.strip() and not line.startswith('#')]
+    return _fill_events(rows)
+
+
+def make_phase_tables(message):
+    """ Creates structured arrays of events and picks from STP phase output.
+    The picks are linked to their events by the evid column.
+    """
+
+    event_rows = []
+    pick_rows = []
+    pick_events = []
+    for line in message.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if EVID_PATTERN.match(line) is not None:
+            event_rows.append(line.split())
+        else:
+            if not event_rows:
+                raise Exception('Error parsing phase output')
+            fields = line.split()
+            if len(fields) != PICK_NFIELDS:
+                raise Exception('Invalid STP phase output')
+            pick_rows.append(fields)
+            pick_events.append(len(event_rows) - 1)
+
+    events = _fill_events(event_rows)
+    picks = np.empty(len(pick_rows), dtype=PICK_DTYPE)
+    if len(pick_rows) == 0:
+        return events, picks
+
+    columns = list(zip(*pick_rows))
+    pick_events = np.array(pick_events)
+    picks['evid'] = events['evid'][pick_events]
+    for i, name in enumerate(['net', 'sta', 'chan', 'loc']):
+        picks[name] = columns[i]
+    for i, name in enumerate(['lat', 'lon', 'elev'], 4):
+        picks[name] = np.array(columns[i], dtype='f8')
+    picks['phase'] = columns[7]
+    picks['first_motion'] = columns[8]
+    picks['onset'] = columns[9]
+    picks['quality'] = np.array(columns[10], dtype='f8')
+    picks['distance'] = np.array(columns[11], dtype='f8')
+    picks['offset'] = np.array(columns[12], dtype='f8')
+    offsets = np.round(picks['offset'] * 1e6).astype('timedelta64[us]')
+    picks['time'] = events['time'][pick_events] + offsets
+    return events, picks
+
+
+# Number of pick lines parsed at a time by make_compact_phase_tables, to
+# limit the memory used by the intermediate Python strings.
+COMPACT_CHUNK_SIZE = 65536
+
+# Names of the interned code columns of EventTable and PickTable.
+EVENT_CODE_COLUMNS = ['type', 'gtype', 'magtype']
+PICK_CODE_COLUMNS = ['net', 'sta', 'chan', 'loc', 'phase', 'first_motion', 'onset']
+
+# Mapping of STP onset codes to obspy.core.event.origin.Pick.onset values.
+ONSET_MAPPING = {'i': 'impulsive', 'e': 'emergent'}
+
+
+def _code_dtype(ncodes):
+    """ Returns the smallest unsigned integer type that can index ncodes codes.
+    """
+
+    if ncodes <= 256:
+        return np.dtype('u1')
+    if ncodes <= 65536:
+        return np.dtype('u2')
+    return np.dtype('u4')
+
+
+def _intern(column, codes):
+    """ Converts a column of strings to an array of indices into codes,
+    a dictionary of code: index, adding any new codes to it.
+    """
+
+    return np.fromiter((codes.setdefault(value, len(codes)) for value in column), dtype='u4', count=len(column))
+
+
+def _to_datetime64(t):
+    """ Converts a datetime64, datetime or UTCDateTime to a datetime64 in microseconds.
+    """
+
+    if isinstance(t, np.datetime64):
+        return t.astype('datetime64[us]')
+    return np.datetime64(utils.to_datetime(t), 'us')
+
+
+def _match_codes(codes, pattern):
+    """ Returns the indices of the codes that match a pattern with the STP
+    wildcards % and _, or any of a list of such patterns.
+    """
+
+    patterns = [pattern] if isinstance(pattern, str) else pattern
+    patterns = [p.replace('%', '*').replace('_', '?') for p in patterns]
+    return [i for i, code in enumerate(codes) if any(fnmatch.fnmatchcase(code, p) for p in patterns)]
+
+
+class _CompactTable:
+    """ Base class of EventTable and PickTable, which store each column
+    as a NumPy array. The string columns listed in CODE_COLUMNS are stored
+    as small integer indices into a list of the distinct values in the
+    codes dictionary, which is shared by the tables selected from a table.
+    """
+
+    __slots__ = ('columns', 'codes')
+    CODE_COLUMNS = []
+
+    def __init__(self, columns, codes):
+        self.columns = columns
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.columns['evid'])
+
+    def __getattr__(self, name):
+        if name in _CompactTable.__slots__:
+            raise AttributeError(name)
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, index):
+        """ Returns a column by name, or a new table with the rows
+        selected by an integer array, boolean mask or slice.
+        """
+
+        if isinstance(index, str):
+            return self.decode(index)
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 if index != -1 else None)
+        return self.__class__({name: values[index] for name, values in self.columns.items()}, self.codes)
+
+    def decode(self, name):
+        """ Returns a column as an array of strings if it is a code column,
+        or else as it is stored.
+        """
+
+        if name in self.CODE_COLUMNS:
+            return np.array(self.codes[name], dtype='U')[self.columns[name]]
+        return self.columns[name]
+
+    def mask(self, name, pattern):
+        """ Returns a boolean mask of the rows whose code column name matches
+        a pattern with the STP wildcards % and _, or a list of patterns.
+        """
+
+        return np.isin(self.columns[name], _match_codes(self.codes[name], pattern))
+
+    def to_array(self, dtype):
+        """ Returns the table as a structured array with string columns.
+        """
+
+        array = np.empty(len(self), dtype=dtype)
+        for name in dtype.names:
+            array[name] = self.decode(name)
+        return array
+
+    def nbytes(self):
+        """ Returns the memory used by the columns in bytes.
+        """
+        return sum(values.nbytes for values in self.columns.values())
+
+
+class EventTable(_CompactTable):
+    """ A compact, column-oriented table of events. The type, gtype and
+    magtype columns are interned codes. Use to_array for a structured
+    array like make_event_table returns, or to_catalog for ObsPy objects.
+    """
+
+    __slots__ = ()
+    CODE_COLUMNS = EVENT_CODE_COLUMNS
+
+    @classmethod
+    def from_array(cls, events):
+        """ Creates an EventTable from a structured array with EVENT_DTYPE.
+        """
+
+        codes = {}
+        columns = {}
+        for name in events.dtype.names:
+            if name in EVENT_CODE_COLUMNS:
+                values, index = np.unique(events[name], return_inverse=True)
+                codes[name] = values.tolist()
+                columns[name] = index.astype(_code_dtype(len(values)))
+            else:
+                columns[name] = events[name].copy()
+        return cls(columns, codes)
+
+    @classmethod
+    def from_message(cls, message):
+        """ Creates an EventTable from STP event or phase output,
+        ignoring any picks.
+        """
+
+        rows = [line.split() for line in message.splitlines()
+                if line.strip() and not line.startswith('#') and EVID_PATTERN.match(line.strip()) is not None]
+        return cls.from_array(_fill_events(rows))
+
+    def select(self, evids=None, start=None, end=None, types=None, mags=None):
+        """ Returns the events with the given event IDs, origin times
+        from start to end, event types and magnitudes from mags[0] to mags[1].
+        """
+
+        mask = np.ones(len(self), dtype=bool)
+        if evids is not None:
+            mask &= np.isin(self.columns['evid'], np.asarray(evids, dtype='i8'))
+        if start is not None:
+            mask &= self.columns['time'] >= _to_datetime64(start)
+        if end is not None:
+            mask &= self.columns['time'] <= _to_datetime64(end)
+        if types is not None:
+            mask &= self.mask('type', types)
+        if mags is not None:
+            mask &= (self.columns['mag'] >= mags[0]) & (self.columns['mag'] <= mags[1])
+        return self[mask]
+
+    def to_array(self):
+        return _CompactTable.to_array(self, EVENT_DTYPE)
+
+    def to_catalog(self, picks=None):
+        """ Creates an ObsPy Catalog of the events, with the picks
+        from a PickTable attached to their events if given.
+        """
+        from obspy.core.event import Catalog, Event, Magnitude, Origin, ResourceIdentifier
+        from obspy.core.utcdatetime import UTCDateTime
+
+        etypes = [utils.ETYPE_MAPPING[code] for code in self.codes['type']]
+        magtypes = [utils.MAGTYPE_MAPPING[code] for code in self.codes['magtype']]
+        event_picks = {}
+        if picks is not None:
+            for evid, pick in zip(picks.columns['evid'].tolist(), picks.to_picks()):
+                event_picks.setdefault(evid, []).append(pick)
+
+        catalog = Catalog()
+        c = self.columns
+        for i in range(len(self)):
+            evid = int(c['evid'][i])
+            origin = Origin(latitude=float(c['lat'][i]), longitude=float(c['lon'][i]), depth=float(c['depth'][i]),
+                            time=UTCDateTime(c['time'][i].item()))
+            magnitude = Magnitude(mag=float(c['mag'][i]), magnitude_type=magtypes[c['magtype'][i]])
+            event = Event(resource_id=ResourceIdentifier(id=str(evid)), event_type=etypes[c['type'][i]],
+                          origins=[origin], magnitudes=[magnitude])
+            event.picks = event_picks.get(evid, [])
+            catalog.append(event)
+        return catalog
+
+
+class PickTable(_CompactTable):
+    """ A compact, column-oriented table of phase picks, linked to their
+    events by the evid column. The net, sta, chan, loc, phase, first_motion
+    and onset columns are interned codes, and the coordinates, distance
+    and offset are single precision. Use to_array for a structured
+    array like make_phase_tables returns, or to_picks for ObsPy Picks.
+    """
+
+    __slots__ = ()
+    CODE_COLUMNS = PICK_CODE_COLUMNS
+
+    def select(self, net=None, sta=None, chan=None, loc=None, phase=None, evids=None, start=None, end=None):
+        """ Returns the picks whose codes match the given patterns, which may
+        use the STP wildcards % and _ or be lists of patterns, with the
+        given event IDs and with pick times from start to end.
+        """
+
+        mask = np.ones(len(self), dtype=bool)
+        for name, pattern in [('net', net), ('sta', sta), ('chan', chan), ('loc', loc), ('phase', phase)]:
+            if pattern is not None:
+                mask &= self.mask(name, pattern)
+        if evids is not None:
+            mask &= np.isin(self.columns['evid'], np.asarray(evids, dtype='i8'))
+        if start is not None:
+            mask &= self.columns['time'] >= _to_datetime64(start)
+        if end is not None:
+            mask &= self.columns['time'] <= _to_datetime64(end)
+        return self[mask]
+
+    def to_array(self):
+        return _CompactTable.to_array(self, PICK_DTYPE)
+
+    def time_uncertainties(self):
+        """ Returns the lower and upper pick time uncertainties in seconds
+        derived from the quality as in utils.make_pick, with NaN where
+        make_pick leaves an uncertainty unset.
+        """
+
+        quality = self.columns['quality']
+        lower = np.where(quality == 0.0, 0.03, np.nan)
+        upper = np.select([quality == 0.0, quality <= 0.3, quality <= 0.5, quality <= 0.8, quality == 1.0],
+                          [np.nan, 0.03, 0.02, 0.01, 0.0], np.nan)
+        return lower, upper
+
+    def to_picks(self):
+        """ Creates a list of ObsPy Picks like utils.make_pick does.
+        Polarity and onset are looked up once per distinct code.
+        """
+        from obspy.core.event.base import QuantityError, WaveformStreamID
+        from obspy.core.event.origin import Pick
+        from obspy.core.utcdatetime import UTCDateTime
+
+        polarities = []
+        for code in self.codes['first_motion']:
+            polarity = utils.POLARITY_MAPPING.get(code[:1], '')
+            if polarity == '':
+                polarity = utils.POLARITY_MAPPING.get(code[1:2], '')
+            polarities.append(polarity or None)
+        onsets = [ONSET_MAPPING.get(code, 'questionable') for code in self.codes['onset']]
+        lower, upper = self.time_uncertainties()
+        decoded = {name: self.codes[name] for name in PICK_CODE_COLUMNS}
+
+        picks = []
+        c = self.columns
+        for i in range(len(self)):
+            pick = Pick()
+            pick.waveform_id = WaveformStreamID(network_code=decoded['net'][c['net'][i]], station_code=decoded['sta'][c['sta'][i]],
+                                                channel_code=decoded['chan'][c['chan'][i]], location_code=decoded['loc'][c['loc'][i]])
+            pick.phase_hint = decoded['phase'][c['phase'][i]]
+            polarity = polarities[c['first_motion'][i]]
+            if polarity is not None:
+                pick.polarity = polarity
+            pick.onset = onsets[c['onset'][i]]
+            if not np.isnan(lower[i]):
+                pick.time_errors = QuantityError(lower_uncertainty=float(lower[i]))
+            elif not np.isnan(upper[i]):
+                pick.time_errors = QuantityError(upper_uncertainty=float(upper[i]))
+            pick.time = UTCDateTime(c['time'][i].item())
+            picks.append(pick)
+        return picks
+
+
+def make_compact_phase_tables(message):
+    """ Creates an EventTable and a PickTable from STP phase output.
+    Pick lines are parsed in chunks of COMPACT_CHUNK_SIZE lines and their
+    codes interned as they are read, so that the memory used is close to
+    the size of the final tables.
+    """
+
+    event_rows = []
+    codes = {name: {} for name in PICK_CODE_COLUMNS}
+    chunks = []
+    chunk = []          # Split pick lines of the current chunk
+    chunk_events = []   # Index in event_rows of the event of each pick in the chunk
+
+    def flush():
+        columns = list(zip(*chunk))
+        parsed = {'event': np.array(chunk_events, dtype='u4')}
+        for i, name in enumerate(['net', 'sta', 'chan', 'loc']):
+            parsed[name] = _intern(columns[i], codes[name])
+        for i, name in enumerate(['lat', 'lon', 'elev'], 4):
+            parsed[name] = np.array(columns[i], dtype='f4')
+        parsed['phase'] = _intern(columns[7], codes['phase'])
+        parsed['first_motion'] = _intern(columns[8], codes['first_motion'])
+        parsed['onset'] = _intern(columns[9], codes['onset'])
+        # Double precision, so that the thresholds of time_uncertainties
+        # compare the same as in utils.make_pick.
+        parsed['quality'] = np.array(columns[10], dtype='f8')
+        parsed['distance'] = np.array(columns[11], dtype='f4')
+        # Kept in double precision until the pick times are computed.
+        parsed['offset'] = np.array(columns[12], dtype='f8')
+        chunks.append(parsed)
+        del chunk[:]
+        del chunk_events[:]
+
+    for line in message.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if EVID_PATTERN.match(line) is not None:
+            event_rows.append(line.split())
+        else:
+            if not event_rows:
+                raise Exception('Error parsing phase output')
+            fields = line.split()
+            if len(fields) != PICK_NFIELDS:
+                raise Exception('Invalid STP phase output')
+            chunk.append(fields)
+            chunk_events.append(len(event_rows) - 1)
+            if len(chunk) >= COMPACT_CHUNK_SIZE:
+                flush()
+    if chunk:
+        flush()
+
+    events = EventTable.from_array(_fill_events(event_rows))
+    columns = {}
+    if chunks:
+        for name in chunks[0]:
+            columns[name] = np.concatenate([parsed[name] for parsed in chunks])
+    else:
+        columns = {name: np.empty(0, dtype='u4') for name in ['event'] + PICK_CODE_COLUMNS}
+        for name in ['lat', 'lon', 'elev', 'quality', 'distance', 'offset']:
+            columns[name] = np.empty(0, dtype='f8' if name in ('quality', 'offset') else 'f4')
+    event_index = columns.pop('event')
+    for name in PICK_CODE_COLUMNS:
+        columns[name] = columns[name].astype(_code_dtype(len(codes[name])))
+    columns['evid'] = events.columns['evid'][event_index]
+    offsets = np.round(columns['offset'] * 1e6).astype('timedelta64[us]')
+    columns['time'] = events.columns['time'][event_index] + offsets
+    columns['offset'] = columns['offset'].astype('f4')
+    pick_codes = {name: list(codes[name]) for name in PICK_CODE_COLUMNS}
+    return events, PickTable(columns, pick_codes)
@@ -1,12 +1,22 @@
-from obspy.core.event import Event
-from obspy.core.event.base import ResourceIdentifier
-from obspy.core.event.origin import Origin
-from obspy.core.event.origin import Pick
-from obspy.core.event.base import WaveformStreamID
-from obspy.core.event.magnitude import Magnitude
-from obspy.core.utcdatetime import UTCDateTime
-from obspy.core.event.base import QuantityError
+import io
+import os
+import re
+from array import array
 from datetime import datetime
+from datetime import timedelta
+
+# ObsPy is imported inside the functions that create ObsPy objects, so that
+# importing pystp and downloading raw files or tables does not load it.
+
+# Format of times in STP commands and output.
+STP_TIME_FORMAT = "%Y/%m/%d,%H:%M:%S.%f"
+
+# Lines of STP phase output that start an event rather than a pick.
+EVID_PATTERN = re.compile('^[1-9]+')
+
+# Limit on the number of events returned by one event or phase
+# command that is assumed when nevntmax has not been set.
+DEFAULT_NEVNTMAX = 100
 
 
 # Mapping of STP magnitude types to obspy.core.event.magnitude.Magnitude.magnitude_type values.
@@ -45,12 +55,18 @@ def make_event(catalog_entry):
     """ Creates an ObsPy Event object from 
     a line of STP event output.
     """
+    from obspy.core.event import Event
+    from obspy.core.event.base import ResourceIdentifier
+    from obspy.core.event.origin import Origin
+    from obspy.core.event.magnitude import Magnitude
+    from obspy.core.utcdatetime import UTCDateTime
+
     #print(catalog_entry)
     fields = catalog_entry.split()
     
     evid = fields[0]
     etype = fields[1]
-    origin_time = UTCDateTime(datetime.strptime(fields[3], "%Y/%m/%d,%H:%M:%S.%f"))
+    origin_time = UTCDateTime(datetime.strptime(fields[3], STP_TIME_FORMAT))
 
     lat = float(fields[4])
     lon = float(fields[5])
@@ -73,6 +89,9 @@ def make_pick(pick_str, origin_time):
     Sample pick_str:
     CI    CLC HHZ --   35.8157  -117.5975   775.0 P c. i  1.0    6.46   1.543
     """
+    from obspy.core.event.origin import Pick
+    from obspy.core.event.base import WaveformStreamID
+    from obspy.core.event.base import QuantityError
     
     fields = pick_str.split()
     if len(fields) != 13:
@@ -118,4 +137,400 @@ def make_pick(pick_str, origin_time):
     offset = float(fields[12])
     new_pick.time = origin_time + offset
 
-    return new_pick
\ No newline at end of file
+    return new_pick
+
+
+def make_trig_command(evid, net='%', sta='%', chan='%', loc='%', radius=None):
+    """ Creates the STP trig command for one event.
+    """
+
+    base_cmd = 'trig '
+    if net != '%':
+        base_cmd += ' -net {}'.format(net)
+    if sta != '%':
+        base_cmd += ' -sta {}'.format(sta)
+    if chan != '%':
+        base_cmd += ' -chan {}'.format(chan)
+    if loc != '%':
+        base_cmd += ' -loc {}'.format(loc)
+    if radius is not None:
+        base_cmd += ' -radius {}'.format(radius)
+    return "{} {}\n".format(base_cmd, evid)
+
+
+def make_wind_command(start_time, end_time, net='%', sta='%', chan='%', loc='%'):
+    """ Creates the STP wind command for a time window.
+    """
+
+    start = start_time.strftime(STP_TIME_FORMAT)
+    end = end_time.strftime(STP_TIME_FORMAT)
+    return f'wind {net} {sta} {chan} {loc} {start} {end} \n'
+
+
+def make_event_phase_command(cmd, evids=None, times=None, lats=None, lons=None, mags=None, depths=None, types=None, gtypes=None, output_file=None):
+    """ Creates an STP event or phase command, which have similar syntax.
+    The returned command does not include the trailing newline.
+    """
+
+    if output_file is not None:
+        cmd += ' -f {} '.format(output_file)
+    if evids is not None:
+        evids_str = [str(e) for e in evids]
+        cmd += ' -e {} '.format(' '.join(evids_str))
+    else:
+        if times is not None:
+            start_time = times[0].strftime(STP_TIME_FORMAT)
+            end_time = times[1].strftime(STP_TIME_FORMAT)
+            cmd += ' -t0 {} {}'.format(start_time, end_time)
+        if lats is not None:
+            cmd += ' -lat {} {}'.format(lats[0], lats[1])
+        if lons is not None:
+            cmd += ' -lon {} {}'.format(lons[0], lons[1])
+        if mags is not None:
+            cmd += ' -mag {} {}'.format(mags[0], mags[1])
+        if depths is not None:
+            cmd += ' -depth {} {}'.format(depths[0], depths[1])
+        if types is not None:
+            cmd += ' -type {} '.format(','.join(types))
+        if gtypes is not None:
+            cmd += ' -gtype {} '.format(','.join(gtypes))
+    return cmd
+
+
+def make_eavail_command(evid, net='', sta='', chan='', loc='', format='s'):
+    """ Creates the STP eavail command for one event.
+    """
+
+    cmd = 'eavail'
+    if net != '':
+        cmd += ' -net {}'.format(net)
+    if sta != '':
+        cmd += ' -sta {}'.format(sta)
+    if chan != '':
+        cmd += ' -chan {}'.format(chan)
+    if loc != '':
+        cmd += ' -loc {}'.format(loc)
+    if format == 'l' or format == 'long':
+        cmd += ' -l'
+    cmd += ' ' + str(evid)
+    cmd += '\n'
+    return cmd
+
+
+def make_catalog(message):
+    """ Creates an ObsPy Catalog from STP event output.
+    """
+    from obspy.core.event import Catalog
+
+    catalog = Catalog()
+    for line in message.splitlines():
+        if not line.startswith('#'):
+            catalog.append(make_event(line))
+    return catalog
+
+
+def make_event_result(message, with_picks=False, as_table=False, lazy=False, raw=False, compact=False, table=None):
+    """ Converts STP event output, or phase output if with_picks is True,
+    to the result selected by the output options of get_events and
+    get_phases. In order of precedence, raw returns the text, compact an
+    EventTable (and PickTable), as_table structured arrays, which are
+    only made if table is None, and lazy a LazyCatalog. Otherwise an
+    ObsPy Catalog is returned.
+    """
+    # Imported here because the tables module depends on this one.
+    from . import tables
+
+    if raw:
+        return message
+    if compact:
+        return tables.make_compact_phase_tables(message) if with_picks else tables.EventTable.from_message(message)
+    if as_table:
+        if table is None:
+            table = tables.make_phase_tables(message) if with_picks else tables.make_event_table(message)
+        return table
+    if lazy:
+        from .lazy import LazyCatalog
+        return LazyCatalog.from_message(message, with_picks)
+    return make_phase_catalog(message) if with_picks else make_catalog(message)
+
+
+def make_phase_catalog(message):
+    """ Creates an ObsPy Catalog with picks from STP phase output.
+    """
+    from obspy.core.event import Catalog
+
+    catalog = Catalog()
+    event = None
+    for line in message.splitlines():
+        line = line.strip()
+        if not line.startswith('#'):
+            if EVID_PATTERN.match(line) is not None:
+                event = make_event(line)
+                catalog.append(event)
+            else:
+                if event is None:
+                    raise Exception('Error parsing phase output')
+                pick = make_pick(line, event.origins[0].time)
+                event.picks.append(pick)
+    return catalog
+
+
+def event_offsets(message, with_picks=False):
+    """ Finds the start and end offsets in message of the text of
+    each event. When with_picks is True, the text of an event
+    includes the pick lines that follow it.
+    """
+
+    starts = array('q')
+    ends = array('q')
+    pos = 0
+    length = len(message)
+    while pos < length:
+        end = message.find('\n', pos)
+        if end == -1:
+            end = length
+        line = message[pos:end].strip()
+        if line and not line.startswith('#'):
+            if not with_picks or EVID_PATTERN.match(line) is not None:
+                starts.append(pos)
+                ends.append(end)
+            elif len(ends) == 0:
+                raise Exception('Error parsing phase output')
+            else:
+                ends[-1] = end
+        pos = end + 1
+    return starts, ends
+
+
+def merge_event_messages(messages, with_picks=False):
+    """ Joins the output of several event or phase commands, keeping
+    only the first copy of each event.
+    """
+
+    if len(messages) == 1:
+        return messages[0]
+    seen = set()
+    parts = []
+    for message in messages:
+        starts, ends = event_offsets(message, with_picks)
+        for start, end in zip(starts, ends):
+            text = message[start:end]
+            evid = text.split(None, 1)[0]
+            if evid not in seen:
+                seen.add(evid)
+                parts.append(text)
+    return '\n'.join(parts) + '\n' if parts else ''
+
+
+def to_datetime(t):
+    """ Converts a datetime or UTCDateTime to a naive UTC datetime.
+    """
+
+    return datetime.strptime(t.strftime(STP_TIME_FORMAT), STP_TIME_FORMAT)
+
+
+def bisect_query(times=None, lats=None, lons=None):
+    """ Splits the time range of an event or phase query in half or, once
+    it is shorter than a second, the latitude and then the longitude range.
+    Returns a list of two (times, lats, lons) tuples, or None if the
+    ranges cannot be split any further.
+    """
+
+    if times is not None:
+        start, end = to_datetime(times[0]), to_datetime(times[1])
+        if end - start > timedelta(seconds=1):
+            middle = start + (end - start) / 2
+            return [([start, middle], lats, lons), ([middle, end], lats, lons)]
+    lats = [-90.0, 90.0] if lats is None else [float(lat) for lat in lats]
+    if lats[1] - lats[0] > 0.001:
+        middle = (lats[0] + lats[1]) / 2
+        return [(times, [lats[0], middle], lons), (times, [middle, lats[1]], lons)]
+    lons = [-180.0, 180.0] if lons is None else [float(lon) for lon in lons]
+    if lons[1] - lons[0] > 0.001:
+        middle = (lons[0] + lons[1]) / 2
+        return [(times, lats, [lons[0], middle]), (times, lats, [middle, lons[1]])]
+    return None
+
+
+def parse_eavail(message, format='s', as_list=True):
+    """ Splits STP eavail output into a list of channels.
+    """
+
+    if not as_list:
+        return message
+    # Remove the comment with the number of seismograms, which will not be part of the list.
+    message = message.split('#')[0]
+    if format == 'l' or format == 'long':
+        return [line.strip().split() for line in message.split('\n') if not line.strip().startswith('#') and not line == '']
+    elif format == 's' or format == 'short':
+        return [line.strip().split('.') for line in message.split() if not line.strip().startswith('#') and not line == '']
+    return message
+
+
+def make_stream(file_lst, buffers=None, keep_files=False, verbose=False):
+    """ Reads downloaded waveform files into an ObsPy Stream.
+
+    If buffers is given, the files are read from the in-memory
+    buffers keyed by file name instead of from disk.
+    """
+    from obspy.core import Stream
+    from obspy.core import read
+
+    waveform_stream = Stream()
+    ntraces = 0
+    for f in file_lst:
+        try:
+            if verbose:
+                print('Reading {}'.format(f))
+            if buffers is not None:
+                buf = buffers.pop(f)
+                buf.seek(0)
+                tr = read(buf)
+            else:
+                tr = read(f)
+            waveform_stream += tr
+            ntraces += 1
+        except TypeError:
+            if verbose:
+                print('{} is in unknown format. Skipping.'.format(f))
+
+        if buffers is None and not keep_files:
+            if verbose:
+                print("Removing {} after reading".format(f))
+            if os.path.isfile(f):
+                os.remove(f)
+    print('Processed {} waveform traces'.format(ntraces))
+    return waveform_stream
+
+
+def read_payload(payload):
+    """ Reads one waveform file, given as a path or as bytes, into a Stream.
+    Returns None if the file is in an unknown format. This is a module
+    level function so that it can be run in a process pool.
+    """
+    from obspy.core import read
+
+    try:
+        if isinstance(payload, str):
+            return read(payload)
+        return read(io.BytesIO(payload))
+    except TypeError:
+        return None
+
+
+def gather_stream(file_lst, futures, verbose=False):
+    """ Combines the results of read_payload calls submitted to an
+    executor, one per downloaded file, into an ObsPy Stream.
+    """
+    from obspy.core import Stream
+
+    waveform_stream = Stream()
+    ntraces = 0
+    for f, future in zip(file_lst, futures):
+        tr = future.result()
+        if tr is None:
+            if verbose:
+                print('{} is in unknown format. Skipping.'.format(f))
+            continue
+        waveform_stream += tr
+        ntraces += 1
+    print('Processed {} waveform traces'.format(ntraces))
+    return waveform_stream
+
+
+def split_time_range(start_time, end_time, chunk_length):
+    """ Splits a time range into consecutive (start, end) chunks of at
+    most chunk_length, which is a timedelta or a number of seconds.
+    """
+
+    if not isinstance(chunk_length, timedelta):
+        chunk_length = timedelta(seconds=chunk_length)
+    if chunk_length <= timedelta(0):
+        raise Exception('Chunk length must be positive')
+    chunks = []
+    chunk_start = start_time
+    while chunk_start < end_time:
+        chunk_end = min(chunk_start + chunk_length, end_time)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+    return chunks
+
+
+def coalesce_windows(requests, merge_components=False, max_gap=0.0):
+    """ Combines (net, sta, chan, loc, start, end) waveform requests into
+    as few wind requests as possible. Requests for the same channels
+    whose time windows overlap or are less than max_gap seconds apart
+    are merged into one window. If merge_components is True, windows
+    that only differ in the last letter of the channel code, such as
+    HHE, HHN and HHZ, are requested with a single HH_ pattern. This
+    saves commands but also downloads any components of the station
+    that were not requested, so it is off by default.
+
+    Returns a list of (net, sta, chan, loc, start, end, members) tuples,
+    where members is the list of the requests covered by each window.
+    """
+
+    gap = timedelta(seconds=max_gap)
+    by_channel = {}
+    for request in dict.fromkeys(tuple(r) for r in requests):
+        net, sta, chan, loc, start, end = request
+        by_channel.setdefault((net, sta, chan, loc), []).append((to_datetime(start), to_datetime(end), request))
+
+    windows = []
+    for (net, sta, chan, loc), spans in by_channel.items():
+        spans.sort(key=lambda span: span[0])
+        start, end, members = spans[0][0], spans[0][1], [spans[0][2]]
+        for span_start, span_end, request in spans[1:]:
+            if span_start <= end + gap:
+                end = max(end, span_end)
+                members.append(request)
+            else:
+                windows.append((net, sta, chan, loc, start, end, members))
+                start, end, members = span_start, span_end, [request]
+        windows.append((net, sta, chan, loc, start, end, members))
+
+    if not merge_components:
+        return windows
+    groups = {}
+    for window in windows:
+        net, sta, chan, loc, start, end, members = window
+        if '%' in chan or '_' in chan:
+            key = (net, sta, chan, None, loc, start, end)
+        else:
+            key = (net, sta, chan[:-1], len(chan), loc, start, end)
+        groups.setdefault(key, []).append(window)
+    merged = []
+    for group in groups.values():
+        if len(group) == 1:
+            merged.append(group[0])
+        else:
+            net, sta, chan, loc, start, end, members = group[0]
+            merged.append((net, sta, chan[:-1] + '_', loc, start, end, [r for window in group for r in window[6]]))
+    return merged
+
+
+def select_window(stream, net, sta, chan, loc, start, end):
+    """ Returns the part of a Stream that matches one waveform request,
+    where net, sta, chan and loc may contain the STP wildcards % and _.
+    """
+    from obspy.core.utcdatetime import UTCDateTime
+
+    patterns = [p.replace('%', '*').replace('_', '?') for p in [net, sta, chan, '' if loc == '--' else loc]]
+    selected = stream.select(network=patterns[0], station=patterns[1], channel=patterns[2], location=patterns[3])
+    return selected.slice(UTCDateTime(to_datetime(start)), UTCDateTime(to_datetime(end)))
+
+
+def merge_streams(streams, fill_value=None):
+    """ Combines the Streams of consecutive time chunks into one Stream
+    with a single trace per channel where possible. Overlapping samples
+    at chunk boundaries are discarded and gaps are filled with fill_value,
+    or left as masked values if fill_value is None.
+    """
+    from obspy.core import Stream
+
+    merged = Stream()
+    for st in streams:
+        if st is not None:
+            merged += st
+    merged.merge(method=1, fill_value=fill_value)
+    return merged
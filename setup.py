@@ -8,5 +8,7 @@ setup(
     version = "0.1",
     packages = find_packages(),
     setup_requires = ["wheel"],
-    install_requires = ["obspy>=1.2.0"]
+    install_requires = ["obspy>=1.2.0", "numpy"],
+    extras_require = {"hdf5": ["h5py"], "parquet": ["pyarrow"]},
+    entry_points = {"console_scripts": ["pystp = pystp.cli:main"]}
     )
@@ -0,0 +1,19 @@
+import pytest
+
+from pystp import STPClient
+from pystp.mock_server import MockSTPServer
+
+
+@pytest.fixture
+def server():
+    with MockSTPServer(nevents=30, npts=500, nevntmax=10) as srv:
+        yield srv
+
+
+@pytest.fixture
+def client(server, tmp_path):
+    client = STPClient(server.host, server.port, output_dir=str(tmp_path))
+    client.connect(show_motd=False)
+    client.set_nevntmax(10)
+    yield client
+    client.disconnect()
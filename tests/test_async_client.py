@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from pystp import AsyncSTPClient
+
+
+async def _truncated_trig():
+    async def handle(reader, writer):
+        await reader.readline()
+        writer.write(b'CONNECTED\n')
+        await reader.readexactly(4)
+        writer.write(b'MESS\nWelcome\nENDmess\nOVER\n')
+        await reader.readline()   # Data format
+        writer.write(b'OVER\n')
+        await reader.readline()   # trig command
+        writer.write(b'FILE 1.sac\nDATA 100\nabc')
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    client = AsyncSTPClient('127.0.0.1', server.sockets[0].getsockname()[1])
+    try:
+        await client.connect(show_motd=False)
+        with pytest.raises(ConnectionError):
+            await client.get_trig('1')
+        assert not client.connected
+    finally:
+        server.close()
+
+
+def test_truncated_response_raises():
+    asyncio.run(_truncated_trig())
+
+
+def test_get_trig(server):
+    async def run():
+        async with AsyncSTPClient(server.host, server.port) as client:
+            return await client.get_trig(['10000000', '10000001'])
+
+    result = asyncio.run(run())
+    assert [len(st) for st in result.values()] == [10, 10]
+
+
+def test_errors_are_recorded(server):
+    async def run():
+        async with AsyncSTPClient(server.host, server.port) as client:
+            await client.get_trig('1')
+            assert client.error == 'Event 1 not found'
+            # The format is sent again after the server rejected it.
+            await client.get_trig('10000000', data_format='seed')
+            assert client.data_format == 'sac'
+            await client.get_trig('10000000', data_format='seed')
+            assert server.command_counts['seed'] == 2
+            result = await client.get_trig('10000000')
+            assert client.error is None
+            assert client.data_format == 'sac'
+            return result
+
+    assert len(asyncio.run(run())['10000000']) == 10
@@ -0,0 +1,27 @@
+from pystp import AvailabilityIndex, STPClient
+from pystp.mock_server import MockSTPServer
+
+
+def test_use_availability_skips_events_without_data(tmp_path):
+    # Only the first 5 events have waveforms.
+    with MockSTPServer(nevents=10, npts=500, data_fraction=0.05) as server:
+        index = AvailabilityIndex()
+        client = STPClient(server.host, server.port, output_dir=str(tmp_path), availability=index)
+        client.connect(show_motd=False)
+        try:
+            evids = ['1000000{}'.format(i) for i in range(10)]
+            result = client.get_trig(evids, use_availability=True, pipeline=4)
+            assert [len(result[evid]) for evid in evids] == [10] * 5 + [0] * 5
+            assert server.command_counts['trig'] == 5
+            assert server.command_counts['eavail'] == 10
+
+            # The index answers repeated lookups, and channels are filtered locally.
+            result = client.get_trig(evids[:2], sta='S001', use_availability=True)
+            assert [len(st) for st in result.values()] == [1, 1]
+            result = client.get_trig(evids[:2], chan='BHZ', use_availability=True)
+            assert [len(st) for st in result.values()] == [0, 0]
+            assert server.command_counts['eavail'] == 10
+            assert server.command_counts['trig'] == 7
+            assert index.channels('10000000', sta='S001') == [c for c in index.get('10000000') if c[1] == 'S001']
+        finally:
+            client.disconnect()
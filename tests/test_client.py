@@ -0,0 +1,170 @@
+import datetime
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from pystp import STPClient, WaveformCache, utils
+from pystp.client import RECV_BUFFER_SIZE
+from pystp.mock_server import MockSTPHandler, MockSTPServer
+
+TIMES = [datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 2)]
+
+
+def test_split_query_merges_all_events(client, server):
+    events = client.get_events(times=TIMES, as_table=True)
+    assert len(events) == 30
+    assert len(set(events['evid'])) == 30
+    assert server.command_counts['event'] > 1
+
+
+def test_split_query_raises_on_failed_part(client, monkeypatch):
+    cmd_event = MockSTPHandler._cmd_event
+    calls = itertools.count()
+
+    def flaky(handler, words):
+        if next(calls) == 2:
+            return handler._error('Database busy')
+        return cmd_event(handler, words)
+
+    monkeypatch.setattr(MockSTPHandler, '_cmd_event', flaky)
+    with pytest.raises(Exception, match='Database busy'):
+        client.get_events(times=TIMES, raw=True)
+    assert client.error == 'Database busy'
+
+
+def test_output_options_precedence(client):
+    assert isinstance(client.get_events(times=TIMES, raw=True, as_table=True), str)
+    assert isinstance(utils.make_event_result('', raw=True, compact=True), str)
+
+
+def test_cache_hits(server, client, tmp_path):
+    client.cache = WaveformCache(str(tmp_path / 'cache'))
+    first = client.get_trig('10000000')['10000000']
+    second = client.get_trig('10000000')['10000000']
+    assert len(first) == len(second) > 0
+    assert server.command_counts['trig'] == 1
+    assert client.stats.summary()['trig']['cached'] == 1
+
+
+def test_cache_hits_skip_the_server(server, client, tmp_path):
+    cache = WaveformCache(str(tmp_path / 'cache'))
+    client.cache = cache
+    client.get_trig('10000000')
+    client.disconnect()
+
+    # The format is not sent for cached requests.
+    other = STPClient(server.host, server.port, output_dir=str(tmp_path), cache=cache)
+    other.connect(show_motd=False)
+    try:
+        assert len(other.get_trig('10000000')['10000000']) > 0
+        assert server.command_counts['sac'] == 1
+    finally:
+        other.disconnect()
+
+    # Cached waveforms are used without a connection.
+    offline = STPClient(server.host, server.port, output_dir=str(tmp_path), cache=cache)
+    result = offline.get_trig(['10000000', '10000001'], pipeline=2)
+    assert len(result['10000000']) > 0
+    assert result['10000001'] is None
+    assert server.command_counts['trig'] == 1
+
+
+def test_empty_responses_are_not_cached(server, client, tmp_path):
+    client.cache = WaveformCache(str(tmp_path / 'cache'))
+    client.get_trig('10000000', sta='NONE')
+    client.get_trig('10000000', sta='NONE')
+    assert server.command_counts['trig'] == 2
+
+
+def test_nevntmax_is_known_without_set_nevntmax(server):
+    # The mock server returns at most 10 events until nevntmax is set.
+    client = STPClient(server.host, server.port)
+    client.connect(show_motd=False)
+    try:
+        assert client.nevntmax == utils.DEFAULT_NEVNTMAX
+        assert len(client.get_phases(times=TIMES, as_table=True)[0]) == 30
+        client.reconnect()
+        assert client.nevntmax == utils.DEFAULT_NEVNTMAX
+    finally:
+        client.disconnect()
+
+
+
+def test_waveforms_are_decoded_from_memory(client, tmp_path):
+    st = client.get_trig('10000000')['10000000']
+    assert len(st) == 10
+    assert not (tmp_path / '10000000').exists()
+
+    st = client.get_trig('10000000', keep_files=True)['10000000']
+    assert len(st) == 10
+    assert len(client.last_files) == 10
+    assert all(os.path.isfile(f) for f in client.last_files)
+
+
+def test_iter_trig_yields_each_event_as_received(server, client):
+    evids = ['10000000', '10000001', '10000002']
+    results = client.iter_trig(evids)
+    evid, st = next(results)
+    assert evid == '10000000' and len(st) == 10
+    assert server.command_counts['trig'] == 1
+    assert [evid for evid, st in results] == evids[1:]
+
+
+def test_pipelined_requests(server, client):
+    evids = ['1000000{}'.format(i) for i in range(6)]
+    result = client.get_trig(evids, pipeline=3)
+    assert list(result) == evids
+    assert [len(st) for st in result.values()] == [10] * 6
+    assert server.command_counts['sac'] == 1
+
+    start = datetime.datetime(2020, 1, 1)
+    st = client.get_continuous(start, start + datetime.timedelta(seconds=60), chan='HHZ', chunk_length=20, pipeline=3)
+    assert len(st) == 10
+    assert all(tr.stats.npts == 6001 for tr in st)
+
+
+def test_closing_a_pipeline_drains_sent_requests(server, client):
+    results = client.iter_trig(['1000000{}'.format(i) for i in range(6)], pipeline=4)
+    evid, st = next(results)
+    assert server.command_counts['trig'] == 4
+    results.close()
+    # The responses of the requests already sent were read and discarded.
+    assert len(client.get_trig('10000005')['10000005']) == 10
+    assert '\n10000005 ' in client.get_events(evids=['10000005'], raw=True)
+
+
+def test_data_blocks_larger_than_the_receive_buffer(tmp_path):
+    npts = 50000
+    with MockSTPServer(nevents=1, npts=npts, block_size=3 * RECV_BUFFER_SIZE + 7) as server:
+        client = STPClient(server.host, server.port, output_dir=str(tmp_path))
+        client.connect(show_motd=False)
+        try:
+            st = client.get_trig('10000000', chan='HHZ')['10000000']
+            st_files = client.get_trig('10000000', chan='HHZ', keep_files=True)['10000000']
+        finally:
+            client.disconnect()
+    expected = (np.sin(np.arange(npts) / 10.0) * 1000).astype('int32')
+    assert len(st) == len(st_files) == 10
+    for tr, tr_file in zip(st, st_files):
+        assert (tr.data == expected).all()
+        assert (tr_file.data == expected).all()
+    assert all(os.path.getsize(f) > RECV_BUFFER_SIZE for f in client.last_files)
+
+
+@pytest.mark.parametrize('executor_class', [ThreadPoolExecutor, ProcessPoolExecutor])
+def test_decode_executor(client, tmp_path, executor_class):
+    evids = ['10000000', '10000001']
+    expected = client.get_trig(evids)
+    client.cache = WaveformCache(str(tmp_path / 'cache'))
+    with executor_class(max_workers=2) as executor:
+        client.set_decode_executor(executor)
+        results = [client.get_trig(evids), client.get_trig(evids, pipeline=2)]
+        client.set_decode_executor(None)
+    assert client.stats.summary()['trig']['cached'] == 2
+    for result in results:
+        for evid in evids:
+            assert [tr.id for tr in result[evid]] == [tr.id for tr in expected[evid]]
+            assert all((tr.data == ref.data).all() for tr, ref in zip(result[evid], expected[evid]))
@@ -0,0 +1,33 @@
+import json
+import os
+
+from pystp import BulkTrigJob
+
+
+def test_bulk_trig_job_resumes_from_journal(client, server, tmp_path):
+    evids = ['10000000', '10000001', '1']
+    job = BulkTrigJob(client, evids, retry_delay=0.0)
+    result = job.run()
+    assert result == {'completed': ['10000000', '10000001'], 'failed': ['1'], 'skipped': []}
+    assert server.command_counts['trig'] == 3
+
+    # A record cut off when the job was killed is ignored, and an event
+    # whose files were removed is downloaded again.
+    with open(job.journal, 'a') as f:
+        f.write('{"evid": "10000002", "sta')
+    records = job.read_journal()
+    os.remove(records['10000001']['files'][0])
+    result = BulkTrigJob(client, evids, retry_delay=0.0).run()
+    assert result == {'completed': ['10000001'], 'failed': ['1'], 'skipped': ['10000000']}
+    assert server.command_counts['trig'] == 5
+    assert all(os.path.isfile(f) for f in job.read_journal()['10000001']['files'])
+
+
+def test_bulk_trig_job_reconnects(client, tmp_path):
+    client.socket.close()
+    job = BulkTrigJob(client, ['10000000'], journal=str(tmp_path / 'journal.jsonl'), retry_delay=0.0)
+    assert job.run()['completed'] == ['10000000']
+    with open(job.journal) as f:
+        record = json.loads(f.readline())
+    assert record['status'] == 'done'
+    assert len(record['files']) == 10
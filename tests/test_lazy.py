@@ -0,0 +1,21 @@
+import datetime
+
+TIMES = [datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 2)]
+
+
+def test_lazy_catalog_creates_events_on_access(client):
+    catalog = client.get_phases(times=TIMES, lazy=True)
+    expected = client.get_phases(times=TIMES)
+    assert len(catalog) == 30
+    assert catalog._events.count(None) == 30
+    assert catalog.evids[0] == '10000000'
+
+    event = catalog[5]
+    assert catalog._events.count(None) == 29
+    assert event.resource_id == expected[5].resource_id
+    assert len(event.picks) == len(expected[5].picks)
+    assert catalog[5] is event
+
+    part = catalog[10:12]
+    assert [e.resource_id for e in part] == [e.resource_id for e in expected[10:12]]
+    assert [e.resource_id for e in catalog.events] == [e.resource_id for e in expected]
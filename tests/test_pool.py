@@ -0,0 +1,49 @@
+import datetime
+
+import pytest
+
+from pystp import STPClientPool
+from pystp.mock_server import MockSTPServer
+
+
+def test_pool_reconnects_lost_sessions(server, tmp_path):
+    with STPClientPool(server.host, server.port, size=1, output_dir=str(tmp_path)) as pool:
+        session = pool.clients[0]
+        session.socket.close()
+        session.connected = False
+        result = pool.get_trig(['10000000', '10000001'])
+        assert [len(st) for st in result.values()] == [10, 10]
+        assert session.connected
+
+
+def test_pool_split_events(server):
+    with STPClientPool(server.host, server.port, size=2) as pool:
+        pool.set_nevntmax(10)
+        events = pool.get_events(times=[datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 2)], as_table=True)
+        assert len(events) == 30
+
+
+def test_pool_reconnects_after_timeout(tmp_path):
+    with MockSTPServer(nevents=5, npts=500, latency=0.3) as server:
+        with STPClientPool(server.host, server.port, size=1, output_dir=str(tmp_path)) as pool:
+            pool.set_timeout(0.1)
+            with pytest.raises(OSError):
+                pool.get_trig('10000000')
+            assert not pool.clients[0].connected
+            pool.set_timeout(5.0)
+            assert len(pool.get_trig('10000000')['10000000']) == 10
+
+
+def test_pool_get_continuous(server, tmp_path):
+    start = datetime.datetime(2020, 1, 1)
+    end = start + datetime.timedelta(seconds=60)
+    with STPClientPool(server.host, server.port, size=2, output_dir=str(tmp_path)) as pool:
+        st = pool.get_continuous(start, end, chan='HHZ', chunk_length=20)
+        assert server.command_counts['wind'] == 3
+        # The chunks of each channel are merged into one trace.
+        assert len(st) == 10
+        assert all(tr.stats.npts == 6001 for tr in st)
+
+        assert pool.get_continuous(start, end) is None
+        assert pool.get_continuous(None, end, chan='HHZ') is None
+        assert server.command_counts['wind'] == 3
@@ -0,0 +1,45 @@
+import time
+
+from pystp.prefetch import TrigPrefetcher, event_ids
+
+EVIDS = ['1000000{}'.format(i) for i in range(8)]
+
+
+def _wait_for_trigs(server, count):
+    deadline = time.time() + 5.0
+    while server.command_counts.get('trig', 0) < count and time.time() < deadline:
+        time.sleep(0.01)
+    # Give the background thread time to request more than it should.
+    time.sleep(0.2)
+    return server.command_counts.get('trig', 0)
+
+
+def test_prefetcher_reads_ahead(client, server):
+    prefetcher = client.prefetch_trig(EVIDS, read_ahead=2)
+    prefetcher.start()
+    assert _wait_for_trigs(server, 2) == 2
+    results = iter(prefetcher)
+    evid, st = next(results)
+    assert evid == EVIDS[0] and len(st) == 10
+    assert _wait_for_trigs(server, 3) == 3
+    assert [evid for evid, st in results] == EVIDS[1:]
+
+
+def test_prefetcher_limits_buffered_bytes(client, server):
+    # Each event holds 10 traces of 500 samples.
+    prefetcher = TrigPrefetcher(client, EVIDS, read_ahead=8, max_bytes=30000)
+    prefetcher.start()
+    assert _wait_for_trigs(server, 2) == 2
+    assert prefetcher.nbytes == 40000
+    prefetcher.close()
+    assert prefetcher.nbytes == 0
+    # The client can be used again after the prefetcher is closed.
+    assert len(client.get_trig(EVIDS[7])[EVIDS[7]]) == 10
+
+
+def test_event_ids(client):
+    events = client.get_events(evids=EVIDS[:3], raw=True)
+    assert event_ids(events) == EVIDS[:3]
+    assert event_ids(client.get_events(evids=EVIDS[:3], as_table=True)) == EVIDS[:3]
+    assert event_ids(client.get_events(evids=EVIDS[:3], lazy=True)) == EVIDS[:3]
+    assert event_ids(EVIDS[0]) == [EVIDS[0]]
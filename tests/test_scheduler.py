@@ -0,0 +1,64 @@
+import socketserver
+import threading
+
+import pytest
+
+from pystp import cli
+from pystp.scheduler import RateLimiter, Scheduler
+
+
+class RejectingHandler(socketserver.StreamRequestHandler):
+    """ Answers the STP handshake with ERR.
+    """
+
+    def handle(self):
+        self.rfile.readline()
+        self.wfile.write(b'ERR Too many connections\n')
+
+
+def test_scheduler_records_every_task(server, tmp_path):
+    def broken(client):
+        raise ValueError('bad task')
+
+    tasks = [('ok', lambda client: client.get_trig('10000000', as_stream=False)),
+             ('missing', lambda client: client.get_trig('999', as_stream=False)),
+             ('broken', broken)]
+    scheduler = Scheduler(server.host, server.port, sessions=2, output_dir=str(tmp_path), max_retries=0, progress_interval=None)
+    result = scheduler.run(tasks)
+    assert result['completed'] == ['ok']
+    assert sorted(label for label, error in result['failed']) == ['broken', 'missing']
+    assert result['unfinished'] == 0
+
+
+def test_cli_exit_codes(server, tmp_path):
+    base = ['--host', server.host, '--port', str(server.port), '-o', str(tmp_path), '--progress', '60', '--retries', '0']
+    assert cli.main(base + ['trig', '-e', '10000000', '10000001']) == 0
+    assert cli.main(base + ['trig', '-e', '10000000', '999']) == 1
+
+
+def test_cli_fails_when_the_server_rejects_sessions(tmp_path):
+    rejecting = socketserver.ThreadingTCPServer(('127.0.0.1', 0), RejectingHandler)
+    rejecting.daemon_threads = True
+    threading.Thread(target=rejecting.serve_forever, daemon=True).start()
+    try:
+        args = ['--host', '127.0.0.1', '--port', str(rejecting.server_address[1]), '-o', str(tmp_path),
+                '--progress', '60', '--retries', '0', 'trig', '-e', '1', '2', '3']
+        assert cli.main(args) == 1
+    finally:
+        rejecting.shutdown()
+        rejecting.server_close()
+
+
+def test_manifest_rejects_windows_without_channels(tmp_path):
+    manifest = tmp_path / 'manifest.txt'
+    manifest.write_text('CI S001 HHZ -- 2020-01-01T00:00:00 2020-01-01T00:10:00\n')
+    assert len(cli.read_manifest(str(manifest))) == 1
+    manifest.write_text('% % % -- 2020-01-01T00:00:00 2020-01-01T00:10:00\n')
+    with pytest.raises(Exception, match='net/sta/chan'):
+        cli.read_manifest(str(manifest))
+
+
+def test_rate_limiter_allows_burst():
+    limiter = RateLimiter(1000.0, burst=3)
+    for i in range(3):
+        limiter.wait()
@@ -0,0 +1,41 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+from pystp.sinks import HDF5Sink, ParquetSink
+
+TIMES = [datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 2)]
+
+
+def test_hdf5_sink(client, tmp_path):
+    h5py = pytest.importorskip('h5py')
+    path = str(tmp_path / 'waveforms.h5')
+    with HDF5Sink(path) as sink:
+        result = client.get_trig(['10000000', '10000001'], sink=sink)
+        assert result == {'10000000': None, '10000001': None}
+        assert sink.ntraces == 20
+    with h5py.File(path, 'r') as f:
+        assert f.attrs['file_format'] == b'ASDF'
+        datasets = [dataset for station in f['Waveforms'].values() for dataset in station.values()]
+        assert len(datasets) == 20
+        assert sorted(set(dataset.attrs['event_ids'] for dataset in datasets)) == [b'10000000', b'10000001']
+    assert not os.path.exists(str(tmp_path / '10000000'))
+
+
+def test_parquet_sink(client, tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    with ParquetSink(str(tmp_path / 'catalog')) as sink:
+        events, picks = client.get_phases(times=TIMES, sink=sink, as_table=True)
+    assert parquet.read_table(str(tmp_path / 'catalog' / 'events.parquet')).num_rows == len(events) == 30
+    assert parquet.read_table(str(tmp_path / 'catalog' / 'picks.parquet')).num_rows == len(picks)
+
+
+def test_sinks_require_optional_dependencies(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'h5py', None)
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    with pytest.raises(ImportError, match=r'pystp\[hdf5\]'):
+        HDF5Sink(str(tmp_path / 'waveforms.h5'))
+    with pytest.raises(ImportError, match=r'pystp\[parquet\]'):
+        ParquetSink(str(tmp_path / 'catalog'))
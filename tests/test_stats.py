@@ -0,0 +1,34 @@
+from pystp import STPClientPool
+
+
+def test_hooks_receive_command_stats(client, server):
+    recorded = []
+    client.add_hook(recorded.append)
+    client.get_trig('10000000')
+    payload_bytes = server.bytes_sent
+    client.get_trig('1')
+    client.remove_hook(recorded.append)
+    client.get_trig('10000001')
+
+    assert [stats.command for stats in recorded] == ['trig', 'trig']
+    stats = recorded[0]
+    assert stats.nfiles == 10
+    # The payloads plus the FILE, DATA and ENDdata lines.
+    assert payload_bytes < stats.bytes_received < payload_bytes + 1000
+    assert stats.error is None
+    assert stats.time_to_first_byte <= stats.total_time
+    assert recorded[1].error == 'Event 1 not found'
+
+    summary = client.stats.summary()['trig']
+    assert summary['count'] == 3
+    assert summary['errors'] == 1
+    assert summary['nfiles'] == 20
+
+
+def test_pool_sessions_share_stats(server):
+    with STPClientPool(server.host, server.port, size=2) as pool:
+        recorded = []
+        pool.add_hook(recorded.append)
+        pool.get_trig(['10000000', '10000001', '10000002'])
+        assert len(recorded) == 3
+        assert pool.stats.summary()['trig']['nfiles'] == 30
@@ -0,0 +1,42 @@
+import datetime
+
+from pystp import utils
+from pystp.store import CatalogStore
+
+
+START = datetime.datetime(2020, 1, 1)
+
+
+def event_commands(server):
+    return sum(n for command, n in server.command_counts.items() if command.lower() == 'event')
+
+
+def test_sync_counts_distinct_events(client, tmp_path):
+    store = CatalogStore(str(tmp_path / 'catalog.db'))
+    # Events on the shared boundaries of the windows are returned twice.
+    nevents = store.sync(client, START, START + datetime.timedelta(minutes=30), window=600)
+    assert nevents == 30
+    assert len(store.get_events(times=[START, START + datetime.timedelta(minutes=30)], raw=True).strip().split('\n')) == 30
+
+
+def test_delta_sync(client, server, tmp_path):
+    store = CatalogStore(str(tmp_path / 'catalog.db'))
+    store.sync(client, START, START + datetime.timedelta(minutes=15), window=3600)
+    before = event_commands(server)
+    assert store.sync(client, START, START + datetime.timedelta(minutes=15), window=3600) == 0
+    assert event_commands(server) == before
+
+    nevents = store.sync(client, START, START + datetime.timedelta(minutes=30), window=3600)
+    assert nevents == 15
+    assert store.synced_range() == (START, START + datetime.timedelta(minutes=30))
+
+
+def test_truncated_window_keeps_stored_events(client, tmp_path, monkeypatch):
+    store = CatalogStore(str(tmp_path / 'catalog.db'))
+    end = START + datetime.timedelta(minutes=30)
+    store.sync(client, START, end, window=300)
+    # A window that reaches nevntmax and cannot be split further.
+    monkeypatch.setattr(utils, 'bisect_query', lambda times, lats, lons: None)
+    store.sync(client, START, end + datetime.timedelta(minutes=1), window=3600, overlap=3600)
+    assert client.truncated
+    assert len(store.get_events(times=[START, end], raw=True).strip().split('\n')) == 30
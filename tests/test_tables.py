@@ -0,0 +1,61 @@
+import datetime
+import subprocess
+import sys
+
+import numpy as np
+
+from pystp import tables, utils
+
+PHASE_MESSAGE = ('10000000 eq l 2020/01/01,00:00:00.000 34.0000 -117.0000 5.00 2.00 l\n' +
+                 ''.join('CI S{:03d} HHZ -- 34.1000 -117.1000 100.0 P c. i {} 10.00 2.500\n'.format(i, quality)
+                         for i, quality in enumerate(['0.0', '0.3', '0.5', '0.8', '1.0', '0.9'])))
+
+
+def test_compact_picks_match_make_pick():
+    expected = [pick for event in utils.make_phase_catalog(PHASE_MESSAGE) for pick in event.picks]
+    events, picks = tables.make_compact_phase_tables(PHASE_MESSAGE)
+    actual = picks.to_picks()
+    assert len(actual) == len(expected) == 6
+    for pick, ref in zip(actual, expected):
+        assert pick.time_errors == ref.time_errors
+        assert pick.time == ref.time
+        assert pick.polarity == ref.polarity
+        assert pick.onset == ref.onset
+        assert pick.waveform_id == ref.waveform_id
+
+
+def test_compact_uncertainty_thresholds():
+    events, picks = tables.make_compact_phase_tables(PHASE_MESSAGE)
+    lower, upper = picks.time_uncertainties()
+    assert lower[0] == 0.03
+    assert list(upper[1:5]) == [0.03, 0.02, 0.01, 0.0]
+
+
+def test_compact_select():
+    events, picks = tables.make_compact_phase_tables(PHASE_MESSAGE)
+    assert len(picks.select(sta='S00_')) == 6
+    assert list(picks.select(sta=['S001', 'S003'])['sta']) == ['S001', 'S003']
+    assert len(picks.select(phase='S')) == 0
+    expected = tables.make_phase_tables(PHASE_MESSAGE)[1]
+    actual = picks.to_array()
+    for name in ['evid', 'net', 'sta', 'chan', 'loc', 'phase', 'first_motion', 'onset', 'quality', 'time']:
+        assert (actual[name] == expected[name]).all()
+
+
+def test_import_does_not_load_numpy():
+    code = 'import sys, pystp; assert "numpy" not in sys.modules and "obspy" not in sys.modules; pystp.EventTable, pystp.HDF5Sink'
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+def test_phase_tables_match_catalog(client):
+    times = [datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 2)]
+    events, picks = client.get_phases(times=times, as_table=True)
+    catalog = client.get_phases(times=times)
+    assert len(events) == len(catalog) == 30
+    assert len(picks) == sum(len(event.picks) for event in catalog)
+    for row, event in zip(events, catalog):
+        origin = event.origins[0]
+        assert str(row['evid']) in event.resource_id.id
+        assert row['time'] == np.datetime64(origin.time.datetime, 'us')
+        assert abs(row['lat'] - origin.latitude) < 1e-6
+        assert abs(row['mag'] - event.magnitudes[0].mag) < 1e-6
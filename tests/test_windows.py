@@ -0,0 +1,45 @@
+import datetime
+
+from pystp import STPClientPool, utils
+
+START = datetime.datetime(2020, 1, 1)
+
+
+def _window(sta, chan, start, end):
+    return ('CI', sta, chan, '--', START + datetime.timedelta(seconds=start), START + datetime.timedelta(seconds=end))
+
+
+def test_coalesce_windows():
+    requests = [_window('S000', 'HHZ', 0, 10), _window('S000', 'HHZ', 5, 20), _window('S000', 'HHZ', 25, 30),
+                _window('S000', 'HHN', 0, 20), _window('S001', 'HHZ', 0, 10), _window('S001', 'HHZ', 0, 10)]
+    windows = utils.coalesce_windows(requests)
+    assert [window[:6] for window in windows] == [_window('S000', 'HHZ', 0, 20), _window('S000', 'HHZ', 25, 30),
+                                                  _window('S000', 'HHN', 0, 20), _window('S001', 'HHZ', 0, 10)]
+    assert windows[0][6] == requests[:2]
+    assert windows[3][6] == [requests[4]]
+
+    assert len(utils.coalesce_windows(requests, max_gap=5.0)) == 3
+    # Only components with the same time window are merged.
+    windows = utils.coalesce_windows(requests, merge_components=True)
+    assert windows[0][:6] == _window('S000', 'HH_', 0, 20)
+    assert windows[0][6] == [requests[0], requests[1], requests[3]]
+    assert len(windows) == 3
+
+
+def test_get_windows_selects_each_request(client, server):
+    requests = [_window('S000', 'HHZ', 0, 10), _window('S000', 'HHZ', 5, 20), _window('S001', 'HHZ', 30, 40)]
+    result = client.get_windows(requests)
+    assert server.command_counts['wind'] == 2
+    for request in requests:
+        st = result[request]
+        assert [tr.stats.station for tr in st] == [request[1]]
+        assert st[0].stats.starttime.datetime == request[4]
+        assert st[0].stats.endtime.datetime == request[5]
+
+
+def test_pool_get_windows(server):
+    requests = [_window('S00{}'.format(i), 'HHZ', 0, 10) for i in range(4)]
+    with STPClientPool(server.host, server.port, size=2) as pool:
+        result = pool.get_windows(requests)
+    assert server.command_counts['wind'] == 4
+    assert [result[request][0].stats.station for request in requests] == ['S000', 'S001', 'S002', 'S003']